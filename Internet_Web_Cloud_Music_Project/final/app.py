@@ -1,9 +1,12 @@
+import asyncio
+import concurrent.futures
 import os
+import random
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, request, jsonify, render_template
-import requests
-import time
-import base64
 from gbmodel.model_datastore import model
+from cache import Cache, shared_tier
+from upstream import AsyncUpstream, SpotifyToken, Upstream, UpstreamError
 
 # Initialize database
 db = model()
@@ -17,41 +20,148 @@ UNSPLASH_API_KEY = os.getenv("UNSPLASH_API_KEY")
 SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
 SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
 
-SPOTIFY_ACCESS_TOKEN = None  # Holds Spotify access token
-SPOTIFY_TOKEN_EXPIRY = None  # Expiry timestamp for Spotify token
+# Pooled, retrying clients shared by every request thread
+http_client = Upstream()
+upstream = AsyncUpstream()
+
+spotify_token = SpotifyToken(SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET, http_client)
+
+# Seconds each endpoint's upstream responses stay cached
+CACHE_TTLS = {
+    "autocomplete": 24 * 3600,  # City names practically never change
+    "weather": 10 * 60,  # OpenWeatherMap updates current conditions about every 10 minutes
+    "photos": 3600,  # A pool of PHOTO_POOL_SIZE random photos per tag, one picked per request
+    "songs": 6 * 3600,
+}
+
+# Random Unsplash photos fetched per call, so cached lookups still vary
+PHOTO_POOL_SIZE = 30
+
+# In-process cache, backed by Redis or SQLite when CACHE_URL is set
+# (e.g. redis://localhost:6379/0 or sqlite:////tmp/cache.db)
+cache = Cache(maxsize=int(os.getenv("CACHE_SIZE", "1024")), shared=shared_tier(os.getenv("CACHE_URL")))
+
+# Threads for cached() lookups that can block, sized for the upstream loop's concurrency
+# rather than the default executor's min(32, CPUs + 4)
+cache_executor = ThreadPoolExecutor(max_workers=int(os.getenv("CACHE_THREADS", "64")), thread_name_prefix="cache")
+
+
+def fetch_json(url, **kwargs):
+    """
+    GET a third-party API over the pooled client and decode its JSON response.
+
+    Raises:
+        UpstreamError: If the response status is not 200, so that failures are never cached.
+    """
+    return http_client.get_json(url, **kwargs)
+
+
+async def cached(endpoint, params, fetch, ttl):
+    """
+    cache.get_or_load for coroutines running on the upstream loop.
+
+    A hit in the in-process tier is answered on the loop. Otherwise the lookup
+    runs on cache_executor, since it may block on the shared tier or on another
+    request loading the same key; on a miss, fetch() is awaited back on the loop.
+    """
+    hit, value = cache.get_local(endpoint, params)
+    if hit:
+        return value
+
+    loop = asyncio.get_running_loop()
+    fetches = []
+
+    def load():
+        future = asyncio.run_coroutine_threadsafe(fetch(), loop)
+        fetches.append(future)
+        return future.result()
+
+    try:
+        return await loop.run_in_executor(cache_executor, cache.get_or_load, endpoint, params, load, ttl)
+    except asyncio.CancelledError:
+        # The worker thread is waiting on fetch(), which cancelling this does not reach
+        for future in fetches:
+            future.cancel()
+        raise
+
+
+def weather_url_for(city):
+    """OpenWeatherMap URL for a "City, Region" string, using only the city name."""
+    city_name = city.split(",")[0].strip()
+    return city_name, f"http://api.openweathermap.org/data/2.5/weather?q={city_name}&appid={WEATHER_API_KEY}&units=metric"
+
+
+def photos_url_for(tags):
+    """Unsplash URL for a pool of PHOTO_POOL_SIZE random photos matching tags."""
+    return f"https://api.unsplash.com/photos/random?query={tags}&count={PHOTO_POOL_SIZE}&client_id={UNSPLASH_API_KEY}"
+
+
+def pick_photo(pool):
+    """One photo from a cached pool, or None if it holds none with image URLs."""
+    photos = [photo for photo in pool if "urls" in photo]
+    return random.choice(photos) if photos else None
+
+
+def log_weather(city, weather_description):
+    """Record a weather lookup in the database."""
+    db.insert(
+        title=f"Weather Data for {city}",
+        description=f"Weather: {weather_description}",
+        weather=weather_description,
+        url="N/A",
+        image_url="N/A",
+        type="Weather",
+        user="N/A",
+    )
+
+
+def select_playlists(playlists, weather):
+    """
+    Keep the search results that have a name, link and image, and record them in the database.
+
+    Returns:
+        list: Playlists shaped for the front end.
+    """
+    valid_playlists = []
+
+    # Safely filter out invalid playlists
+    for playlist in playlists:
+        if not playlist:
+            continue
+        name = playlist.get("name")
+        url = playlist.get("external_urls", {}).get("spotify")
+        images = playlist.get("images")
+
+        if name and url and images:
+            valid_playlists.append({
+                "name": name,
+                "description": playlist.get("description", "No description available."),
+                "url": url,
+                "image": images[0].get("url") if images else "/static/default_image.jpg",
+            })
+            # Insert the valid playlist into the database
+            db.insert(
+                title=name,
+                description=playlist.get("description", ""),
+                weather=weather,
+                url=url,
+                image_url=images[0].get("url") if images else "",
+                type="Playlist",
+                user="N/A",
+            )
+    return valid_playlists
 
 
 def get_spotify_token():
     """
-    Fetch and cache Spotify access token using client credentials flow.
+    Return a Spotify access token from the shared token manager.
 
     Returns:
         str: Spotify access token.
     Raises:
         Exception: If unable to retrieve Spotify access token.
     """
-    global SPOTIFY_ACCESS_TOKEN, SPOTIFY_TOKEN_EXPIRY
-    if SPOTIFY_TOKEN_EXPIRY and time.time() < SPOTIFY_TOKEN_EXPIRY:
-        return SPOTIFY_ACCESS_TOKEN
-
-    auth_header = f"{SPOTIFY_CLIENT_ID}:{SPOTIFY_CLIENT_SECRET}"
-    encoded_auth = base64.b64encode(auth_header.encode()).decode()
-
-    url = "https://accounts.spotify.com/api/token"
-    headers = {
-        "Authorization": f"Basic {encoded_auth}",
-        "Content-Type": "application/x-www-form-urlencoded",
-    }
-    data = {"grant_type": "client_credentials"}
-    response = requests.post(url, headers=headers, data=data)
-
-    if response.status_code == 200:
-        response_data = response.json()
-        SPOTIFY_ACCESS_TOKEN = response_data.get("access_token")
-        SPOTIFY_TOKEN_EXPIRY = time.time() + response_data.get("expires_in", 3600)
-        return SPOTIFY_ACCESS_TOKEN
-    else:
-        raise Exception("Unable to retrieve Spotify access token.")
+    return spotify_token.get()
 
 
 @app.route("/")
@@ -87,17 +197,22 @@ def autocomplete():
     # Google Places Autocomplete API URL
     places_url = f"https://maps.googleapis.com/maps/api/place/autocomplete/json?input={input_text}&types=(cities)&key={GOOGLE_PLACES_API_KEY}"
 
+    def load_predictions():
+        data = fetch_json(places_url)
+        # Quota and key errors also come back as 200, with an error status in the body
+        if data.get("status") not in ("OK", "ZERO_RESULTS"):
+            raise UpstreamError(200, data.get("error_message", data.get("status", "")))
+        return [
+            {"description": prediction["description"]}
+            for prediction in data.get("predictions", [])
+        ]
+
     try:
-        response = requests.get(places_url)
-        if response.status_code == 200:
-            data = response.json()
-            predictions = [
-                {"description": prediction["description"]}
-                for prediction in data.get("predictions", [])
-            ]
-            return jsonify({"predictions": predictions})
-        else:
-            return jsonify({"error": "Failed to fetch city suggestions", "details": response.text}), 500
+        predictions = cache.get_or_load("autocomplete", {"input": input_text}, load_predictions,
+                                        CACHE_TTLS["autocomplete"])
+        return jsonify({"predictions": predictions})
+    except UpstreamError as e:
+        return jsonify({"error": "Failed to fetch city suggestions", "details": e.text}), 500
     except Exception as e:
         return jsonify({"error": "Unexpected error occurred"}), 500
 
@@ -118,28 +233,15 @@ def get_weather():
     if not city:
         return jsonify({"error": "City not provided"}), 400
  
-    if "," in city:
-        city_name = city.split(",")[0].strip()
-    else:
-        city_name = city.strip()
-
-    weather_url = f"http://api.openweathermap.org/data/2.5/weather?q={city_name}&appid={WEATHER_API_KEY}&units=metric"
-    response = requests.get(weather_url)
-    if response.status_code == 200:
-        weather_data = response.json()
-        weather_description = weather_data["weather"][0]["description"]
-
+    city_name, weather_url = weather_url_for(city)
+    try:
+        weather_data = cache.get_or_load("weather", {"q": city_name}, lambda: fetch_json(weather_url),
+                                         CACHE_TTLS["weather"])
+    except UpstreamError:
+        weather_data = None
+    if weather_data is not None:
         # Log weather data into the database
-        db.insert(
-            title=f"Weather Data for {city}",
-            description=f"Weather: {weather_description}",
-            weather=weather_description,
-            url="N/A",
-            image_url="N/A",
-            type="Weather",
-            user="N/A",
-        )
-
+        log_weather(city, weather_data["weather"][0]["description"])
         return jsonify(weather_data)
     else:
         return jsonify({"error": "Unable to fetch weather data"}), 500
@@ -161,18 +263,18 @@ def get_photos():
         return jsonify({"error": "Tags not provided"}), 400
 
     # Build the Unsplash API URL
-    unsplash_url = f"https://api.unsplash.com/photos/random?query={tags}&client_id={UNSPLASH_API_KEY}"
+    unsplash_url = photos_url_for(tags)
 
     try:
-        response = requests.get(unsplash_url)
-        if response.status_code == 200:
-            data = response.json()
-            if "urls" in data:
-                return jsonify(data)
-            else:
-                return jsonify({"error": "No image found"}), 404
+        pool = cache.get_or_load("photos", {"query": tags, "count": PHOTO_POOL_SIZE},
+                                 lambda: fetch_json(unsplash_url), CACHE_TTLS["photos"])
+        data = pick_photo(pool)
+        if data is not None:
+            return jsonify(data)
         else:
-            return jsonify({"error": "Failed to fetch Unsplash image", "details": response.text}), 500
+            return jsonify({"error": "No image found"}), 404
+    except UpstreamError as e:
+        return jsonify({"error": "Failed to fetch Unsplash image", "details": e.text}), 500
     except Exception as e:
         return jsonify({"error": "Unexpected error occurred"}), 500
 
@@ -192,46 +294,105 @@ def get_songs():
     if not weather:
         return jsonify({"error": "Weather description not provided"}), 400
 
-    get_spotify_token()
-    spotify_url = f"https://api.spotify.com/v1/search?q={weather}&type=playlist&limit=5"
-    headers = {"Authorization": f"Bearer {SPOTIFY_ACCESS_TOKEN}"}
-    response = requests.get(spotify_url, headers=headers)
-
-    if response.status_code == 200:
-        playlists = response.json().get("playlists", {}).get("items", [])
-        valid_playlists = []
-        
-        # Safely filter out invalid playlists
-        for playlist in playlists:
-            if not playlist:
-                continue
-            name = playlist.get("name")
-            url = playlist.get("external_urls", {}).get("spotify")
-            images = playlist.get("images")
-
-            if name and url and images:
-                valid_playlists.append({
-                    "name": name,
-                    "description": playlist.get("description", "No description available."),
-                    "url": url,
-                    "image": images[0].get("url") if images else "/static/default_image.jpg",
-                })
-                # Insert the valid playlist into the database
-                db.insert(
-                    title=name,
-                    description=playlist.get("description", ""),
-                    weather=weather,
-                    url=url,
-                    image_url=images[0].get("url") if images else "",
-                    type="Playlist",
-                    user="N/A",
-                )
-
-        return jsonify(valid_playlists)
+    def load_playlists():
+        spotify_url = f"https://api.spotify.com/v1/search?q={weather}&type=playlist&limit=5"
+        headers = {"Authorization": f"Bearer {get_spotify_token()}"}
+        return fetch_json(spotify_url, headers=headers).get("playlists", {}).get("items", [])
+
+    try:
+        playlists = cache.get_or_load("songs", {"q": weather}, load_playlists, CACHE_TTLS["songs"])
+    except UpstreamError:
+        playlists = None
+    if playlists is not None:
+        return jsonify(select_playlists(playlists, weather))
     else:
         return jsonify({"error": "Unable to fetch playlists"}), 500
 
 
+@app.route("/api/mood")
+def mood():
+    """
+    Fetch the weather for a city, then an outfit photo and matching playlists at the same time.
+
+    Replaces the front end's three sequential calls to /get_weather,
+    /get_photos and /get_songs with one round trip. The photo and playlist
+    lookups run concurrently on the pooled async client, so the response
+    takes about the weather call plus the slower of the two.
+
+    Query Parameters:
+        city (str): Name of the city.
+
+    Returns:
+        JSON: weather, photo and playlists, with an errors entry for any lookup that failed.
+    """
+    city = request.args.get("city")
+    if not city:
+        return jsonify({"error": "City not provided"}), 400
+
+    city_name, weather_url = weather_url_for(city)
+    try:
+        weather_data = cache.get_or_load("weather", {"q": city_name},
+                                         lambda: upstream.run(upstream.get_json(weather_url)),
+                                         CACHE_TTLS["weather"])
+    except UpstreamError:
+        return jsonify({"error": "Unable to fetch weather data"}), 500
+    weather = weather_data["weather"][0]["description"]
+    log_weather(city, weather)
+
+    tags = "winter outfit" if weather_data["main"]["temp"] <= 10 else "summer outfit"
+    unsplash_url = photos_url_for(tags)
+    spotify_url = f"https://api.spotify.com/v1/search?q={weather}&type=playlist&limit=5"
+
+    # Fetched here rather than on the loop, where its blocking request would stall every other call
+    try:
+        token = get_spotify_token()
+    except Exception:
+        token = None
+
+    async def fetch_playlists():
+        if token is None:
+            raise UpstreamError(401, "Unable to retrieve Spotify access token.")
+        headers = {"Authorization": f"Bearer {token}"}
+        return (await upstream.get_json(spotify_url, headers=headers)).get("playlists", {}).get("items", [])
+
+    async def fan_out():
+        return await asyncio.gather(
+            cached("photos", {"query": tags, "count": PHOTO_POOL_SIZE}, lambda: upstream.get_json(unsplash_url),
+                   CACHE_TTLS["photos"]),
+            cached("songs", {"q": weather}, fetch_playlists, CACHE_TTLS["songs"]),
+            return_exceptions=True,
+        )
+
+    try:
+        photos, playlists = upstream.run(fan_out(), timeout=30)
+    except concurrent.futures.TimeoutError as e:
+        # Reported like any other failed photo and playlist lookup
+        photos = playlists = e
+
+    errors = {}
+    photo = None if isinstance(photos, Exception) else pick_photo(photos)
+    if photo is None:
+        errors["photo"] = "Failed to fetch Unsplash image" if isinstance(photos, Exception) else "No image found"
+    if isinstance(playlists, Exception):
+        errors["playlists"] = "Unable to fetch playlists"
+        playlists = None
+    else:
+        playlists = select_playlists(playlists, weather)
+
+    return jsonify({"weather": weather_data, "photo": photo, "playlists": playlists, "errors": errors})
+
+
+@app.route("/cache_stats")
+def cache_stats():
+    """
+    Report the upstream cache's hits, misses and hit rate per endpoint.
+
+    Returns:
+        JSON: Counters since this worker started.
+    """
+    return jsonify(cache.stats())
+
+
 @app.route("/trending_playlists")
 def trending_playlists():
     """
@@ -0,0 +1,263 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_key(endpoint, params):
+    """
+    Build a cache key from an endpoint name and its query parameters.
+
+    String values are lowercased and their whitespace collapsed, so "Paris",
+    " paris" and "PARIS " share one entry.
+    """
+    normalized = []
+    for name, value in sorted(params.items()):
+        if isinstance(value, str):
+            value = " ".join(value.split()).lower()
+        normalized.append(f"{name}={value}")
+    return endpoint + ":" + "&".join(normalized)
+
+
+class LocalTier:
+    """In-process LRU cache whose entries also expire at a fixed time."""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (hit, value, expires_at)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None, None
+            if entry[1] <= time.time():
+                del self._entries[key]
+                return False, None, None
+            self._entries.move_to_end(key)
+            return True, entry[0], entry[1]
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteTier:
+    """
+    Cache shared by every worker process on one host, kept in a SQLite file.
+
+    Values are stored as JSON. Expired rows are purged every purge_every writes.
+    """
+
+    def __init__(self, path, purge_every=500):
+        self.path = path
+        self.purge_every = purge_every
+        self._writes = 0
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)"
+        )
+        conn.commit()
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=5)
+        return conn
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT value, expires_at FROM cache WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        if row is None:
+            return False, None, None
+        return True, json.loads(row[0]), row[1]
+
+    def set(self, key, value, expires_at):
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), expires_at),
+        )
+        self._writes += 1
+        if self._writes % self.purge_every == 0:
+            conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+        conn.commit()
+
+
+class RedisTier:
+    """Cache shared by every instance, kept in Redis. Redis expires the keys itself."""
+
+    def __init__(self, url, prefix="cache:"):
+        import redis  # Only needed when CACHE_URL points at Redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            return False, None, None
+        entry = json.loads(raw)
+        return True, entry["value"], entry["expires_at"]
+
+    def set(self, key, value, expires_at):
+        ttl = int(expires_at - time.time())
+        if ttl > 0:
+            self.client.set(self.prefix + key, json.dumps({"value": value, "expires_at": expires_at}), ex=ttl)
+
+
+def shared_tier(url):
+    """
+    Build the shared tier named by a CACHE_URL value.
+
+    Args:
+        url (str): "redis://host:port/db", "sqlite:///path/to/cache.db", or empty for none.
+    Returns:
+        RedisTier, SQLiteTier or None.
+    """
+    if not url:
+        return None
+    if url.startswith(("redis://", "rediss://")):
+        return RedisTier(url)
+    if url.startswith("sqlite:///"):
+        return SQLiteTier(url[len("sqlite:///"):])
+    raise ValueError(f"Unsupported CACHE_URL: {url}")
+
+
+class _Flight:
+    """An upstream call in progress, which other requests for the same key wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class Cache:
+    """
+    Two-tier cache for upstream API responses.
+
+    Lookups go to the in-process LRU tier, then the optional shared tier, and
+    only then to the loader. While one request is loading a key, concurrent
+    requests for the same key wait for its result instead of calling the
+    upstream API themselves. Failed loads are not cached.
+    """
+
+    counters = ("local_hits", "shared_hits", "coalesced", "misses", "errors", "shared_errors")
+
+    def __init__(self, maxsize=1024, shared=None):
+        self.local = LocalTier(maxsize)
+        self.shared = shared
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _count(self, endpoint, counter):
+        with self._lock:
+            stats = self._stats.setdefault(endpoint, dict.fromkeys(self.counters, 0))
+            stats[counter] += 1
+
+    def get_local(self, endpoint, params, key=None):
+        """
+        Look endpoint and params up in the in-process tier only, which never blocks.
+
+        Returns:
+            (hit, value); hits are counted like those of get_or_load.
+        """
+        hit, value, _ = self.local.get(key or make_key(endpoint, params))
+        if hit:
+            self._count(endpoint, "local_hits")
+        return hit, value
+
+    def get_or_load(self, endpoint, params, loader, ttl):
+        """
+        Return the cached response for endpoint and params, calling loader on a miss.
+
+        Args:
+            endpoint (str): Name of the upstream endpoint, also used for the metrics.
+            params (dict): Query parameters that identify the response.
+            loader (callable): Fetches the response; whatever it raises is passed on.
+            ttl (float): Seconds a loaded response stays cached.
+        Returns:
+            The cached or freshly loaded response.
+        """
+        key = make_key(endpoint, params)
+        hit, value = self.get_local(endpoint, params, key)
+        if hit:
+            return value
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            flight.done.wait()
+            self._count(endpoint, "coalesced")
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            # A leader that finished between our local miss and taking the lock has already stored it
+            hit, value, _ = self.local.get(key)
+            if hit:
+                self._count(endpoint, "local_hits")
+                flight.value = value
+                return value
+            if self.shared is not None:
+                try:
+                    hit, value, expires_at = self.shared.get(key)
+                except Exception:
+                    # A shared tier that is down only costs its hit rate
+                    self._count(endpoint, "shared_errors")
+            if hit:
+                self._count(endpoint, "shared_hits")
+                self.local.set(key, value, expires_at)
+            else:
+                self._count(endpoint, "misses")
+                value = loader()
+                expires_at = time.time() + ttl
+                self.local.set(key, value, expires_at)
+                if self.shared is not None:
+                    try:
+                        self.shared.set(key, value, expires_at)
+                    except Exception:
+                        self._count(endpoint, "shared_errors")
+            flight.value = value
+            return value
+        except Exception as e:
+            self._count(endpoint, "errors")
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def stats(self):
+        """
+        Per-endpoint counters and hit rate since startup.
+
+        hit_rate counts local, shared and coalesced lookups as hits, since none of them reached the upstream API.
+        """
+        with self._lock:
+            report = {}
+            for endpoint, stats in self._stats.items():
+                hits = stats["local_hits"] + stats["shared_hits"] + stats["coalesced"]
+                lookups = hits + stats["misses"]
+                report[endpoint] = dict(stats, hit_rate=hits / lookups if lookups else 0.0)
+            return {"endpoints": report, "local_entries": len(self.local)}
@@ -0,0 +1,238 @@
+import asyncio
+import base64
+import concurrent.futures
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import httpx
+import requests
+
+# Responses worth retrying; anything else is returned to the caller at once
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class UpstreamError(Exception):
+    """Raised when a third-party API does not answer with a usable response."""
+
+    def __init__(self, status_code, text):
+        super().__init__(f"Upstream API returned {status_code}")
+        self.status_code = status_code
+        self.text = text
+
+
+def backoff_delay(attempt, retry_after=None, backoff=0.3, max_backoff=5.0):
+    """
+    Seconds to wait before retry number attempt + 1: Retry-After if given, else jittered exponential backoff.
+
+    Returns None when Retry-After asks for more than max_backoff, since retrying
+    sooner than the server allows would only be refused again.
+    """
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                # Retry-After may also be an HTTP date
+                delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                delay = None
+        if delay is not None:
+            return max(delay, 0.0) if delay <= max_backoff else None
+    return min(max_backoff, backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+class Upstream:
+    """
+    Blocking HTTP client shared by all request threads.
+
+    One requests.Session keeps a pool of keep-alive connections per host, so
+    handlers stop paying a TCP and TLS handshake per call. Every request gets
+    a timeout, and connection errors, timeouts, 429s and 5xx responses are
+    retried with jittered backoff.
+    """
+
+    def __init__(self, timeout=(3.05, 10), retries=2, pool_maxsize=16):
+        self.timeout = timeout
+        self.retries = retries
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, method, url, **kwargs):
+        """Send a request, retrying transient failures. Returns the last response."""
+        kwargs.setdefault("timeout", self.timeout)
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+                retry_after = None
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    return response
+                retry_after = response.headers.get("Retry-After")
+            delay = backoff_delay(attempt, retry_after)
+            if delay is None:
+                return response
+            time.sleep(delay)
+
+    def get_json(self, url, **kwargs):
+        """
+        GET url and decode its JSON response.
+
+        Raises:
+            UpstreamError: If the final response status is not 200.
+        """
+        response = self.request("GET", url, **kwargs)
+        if response.status_code != 200:
+            raise UpstreamError(response.status_code, response.text)
+        return response.json()
+
+
+class AsyncUpstream:
+    """
+    Async HTTP client running on a background event loop, shared by all request threads.
+
+    Flask handlers stay synchronous; they hand coroutines to run() and wait for
+    the result, while the loop multiplexes every in-flight upstream call over
+    one pool of keep-alive connections. The loop is started on first use, so
+    each gunicorn worker gets its own after forking.
+    """
+
+    def __init__(self, timeout=10.0, retries=2, max_connections=100, max_keepalive=20):
+        self.timeout = timeout
+        self.retries = retries
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive)
+        self.loop = None
+        self.client = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self.loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="upstream-loop", daemon=True).start()
+
+                async def make_client():
+                    return httpx.AsyncClient(timeout=self.timeout, limits=self.limits)
+
+                self.client = asyncio.run_coroutine_threadsafe(make_client(), loop).result()
+                self.loop = loop
+        return self.loop
+
+    def run(self, coro, timeout=None):
+        """
+        Run a coroutine on the background loop and wait for its result.
+
+        Must be called from a request thread, never from the loop itself.
+
+        Raises:
+            concurrent.futures.TimeoutError: If timeout passes first; the coroutine is cancelled.
+        """
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop or self._start())
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            # Otherwise it would keep running, and holding its connections, after the caller gave up
+            future.cancel()
+            raise
+
+    async def get_json(self, url, **kwargs):
+        """
+        GET url and decode its JSON response, retrying transient failures like Upstream.
+
+        Raises:
+            UpstreamError: If the final response status is not 200.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                response = await self.client.get(url, **kwargs)
+            except httpx.TransportError:
+                if attempt == self.retries:
+                    raise
+                retry_after = None
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    break
+                retry_after = response.headers.get("Retry-After")
+            delay = backoff_delay(attempt, retry_after)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+        if response.status_code != 200:
+            raise UpstreamError(response.status_code, response.text)
+        return response.json()
+
+
+class SpotifyToken:
+    """
+    Spotify client-credentials token shared by all request threads.
+
+    The token is refreshed refresh_margin seconds before it expires, by one
+    thread at a time. While that refresh runs, other threads keep using the
+    current token; only once it has actually expired do they wait for the
+    new one, so a burst of requests near expiry makes a single token call.
+    """
+
+    token_url = "https://accounts.spotify.com/api/token"
+
+    def __init__(self, client_id, client_secret, http, refresh_margin=60):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.http = http
+        self.refresh_margin = refresh_margin
+        self.refreshes = 0
+        self._state = (None, 0.0)  # (token, expiry timestamp), replaced as a whole
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Return a valid access token, fetching a new one if needed.
+
+        Raises:
+            Exception: If no valid token is held and a new one cannot be retrieved.
+        """
+        token, expires_at = self._state
+        now = time.time()
+        if token and now < expires_at - self.refresh_margin:
+            return token
+        if token and now < expires_at:
+            # Refresh ahead of expiry, unless another thread already is
+            if not self._lock.acquire(blocking=False):
+                return token
+        else:
+            self._lock.acquire()
+        try:
+            token, expires_at = self._state
+            if token and time.time() < expires_at - self.refresh_margin:
+                return token
+            try:
+                return self._refresh()
+            except Exception:
+                # A failed early refresh still leaves the current token usable
+                if token and time.time() < expires_at:
+                    return token
+                raise
+        finally:
+            self._lock.release()
+
+    def _refresh(self):
+        auth_header = f"{self.client_id}:{self.client_secret}"
+        encoded_auth = base64.b64encode(auth_header.encode()).decode()
+        headers = {
+            "Authorization": f"Basic {encoded_auth}",
+            "Content-Type": "application/x-www-form-urlencoded",
+        }
+        response = self.http.request("POST", self.token_url, headers=headers,
+                                     data={"grant_type": "client_credentials"})
+        if response.status_code != 200:
+            raise Exception("Unable to retrieve Spotify access token.")
+        response_data = response.json()
+        token = response_data.get("access_token")
+        self._state = (token, time.time() + response_data.get("expires_in", 3600))
+        self.refreshes += 1
+        return token
@@ -1,107 +1,274 @@
+import gzip
 import json
+import os
 import boto3
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
 from datetime import datetime
-from io import StringIO
+from io import BytesIO, StringIO
 import pandas as pd 
+# Packaged alongside this handler; the Glue job maps columns with the same schema
+import spotify_schema
 
-def album(data):
-    album_list = []
-    for row in data['items']:
-        album_id = row['track']['album']['id']
-        album_name = row['track']['album']['name']
-        album_release_date = row['track']['album']['release_date']
-        album_total_tracks = row['track']['album']['total_tracks']
-        album_url = row['track']['album']['external_urls']['spotify']
-        album_element = {'album_id':album_id,'name':album_name,'release_date':album_release_date,
-                            'total_tracks':album_total_tracks,'url':album_url}
-        album_list.append(album_element)
-    return album_list
+Bucket = os.environ.get('SPOTIFY_BUCKET', "spotify-etl-project-darshil")
+Key = "raw_data/to_processed/"
+processed_prefix = "raw_data/processed/"
+# Raw files that were transformed but not yet archived, one empty marker object per
+# file under this prefix; the next run archives them instead of transforming them again
+archive_ledger = "raw_data/archive_pending/"
+# No new file is started with less than this left before the Lambda timeout,
+# so the run still has time to archive what it transformed
+time_margin_ms = int(os.environ.get('SPOTIFY_TIME_MARGIN_MS', 60000))
+# Raw files downloaded at once; memory holds at most this many parsed playlists
+max_workers = int(os.environ.get('SPOTIFY_FETCH_WORKERS', 8))
+# "files" writes three CSVs per raw file; "consolidated" writes one deduplicated
+# Parquet object per entity for the whole run, under date=YYYY-MM-DD/ if partition_by_date
+output_mode = os.environ.get('SPOTIFY_OUTPUT_MODE', 'files')
+partition_by_date = os.environ.get('SPOTIFY_PARTITION_BY_DATE', '1') == '1'
+
+def compile_getter(path):
+    """Function reading a spotify_schema field path from an item, or None where a step is missing."""
+    parts = spotify_schema.split_path(path)
+    def get(value):
+        try:
+            for part in parts:
+                value = value[part]
+            return value
+        except (KeyError, IndexError, TypeError):
+            return None
+    return get
+
+# (entity, getter of its list or None, key column, key getter, [(column, getter)]), built once per container
+extract_plan = [
+    (name, compile_getter(spec['each']) if spec['each'] else None,
+     spec['key'], compile_getter(dict(spec['fields'])[spec['key']]),
+     [(column, compile_getter(path)) for column, path in spec['fields'] if column != spec['key']])
+    for name, spec in spotify_schema.entities.items()
+]
+
+def extract(data):
+    """Walk the playlist items once and return {entity: {column: [values]}} for every entity.
+
+    Rows whose key was already seen in the file are skipped before their other
+    fields are read, so each entity comes out deduplicated. Rows without a key
+    (a null track, a local file with no track id) are skipped too and counted
+    in the returned {entity: rejected rows}.
+    """
+    buffers = {name: {column: [] for column, _ in spotify_schema.entities[name]['fields']}
+               for name, _, _, _, _ in extract_plan}
+    rejects = dict.fromkeys(buffers, 0)
+    plan = [(name, each, get_key, buffers[name][key].append, set(),
+             [(buffers[name][column].append, get) for column, get in fields])
+            for name, each, key, get_key, fields in extract_plan]
+    for item in data['items']:
+        for name, each, get_key, append_key, seen, fields in plan:
+            for element in ((item,) if each is None else each(item) or ()):
+                key = get_key(element)
+                if key is None:
+                    rejects[name] += 1
+                    continue
+                if key in seen:
+                    continue
+                seen.add(key)
+                append_key(key)
+                for append, get in fields:
+                    append(get(element))
+    return buffers, rejects
+    
+def list_raw_keys(s3, bucket, prefix):
+    """Yield every raw file key under prefix, following pagination past 1000 keys."""
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for file in page.get('Contents', []):
+            if file['Key'].endswith((".json", ".ndjson.gz")):
+                yield file['Key']
+
+def fetch_playlist(s3, bucket, file_key):
+    response = s3.get_object(Bucket=bucket, Key=file_key)
+    body = response['Body'].read()
+    if file_key.endswith(".ndjson.gz"):
+        # Written by the extractor with one playlist item per line
+        return {'items': [json.loads(line) for line in gzip.decompress(body).splitlines() if line]}
+    return json.loads(body)
+
+def iter_playlists(s3, bucket, keys, workers=max_workers):
+    """Yield (key, playlist) pairs as downloads finish, with at most workers files in flight.
+
+    New downloads are only started as finished ones are handed out, so the
+    caller transforms each file while the next ones are still downloading and
+    memory never holds more than the in-flight files.
+    """
+    keys = iter(keys)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight = {}
+        for file_key in keys:
+            in_flight[pool.submit(fetch_playlist, s3, bucket, file_key)] = file_key
+            if len(in_flight) >= workers:
+                break
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                file_key = in_flight.pop(future)
+                next_key = next(keys, None)
+                if next_key is not None:
+                    in_flight[pool.submit(fetch_playlist, s3, bucket, next_key)] = next_key
+                yield file_key, future.result()
+
+def transform(data):
+    """Album, artist and song DataFrames of one raw playlist file."""
+    buffers, rejects = extract(data)
+    for name, count in rejects.items():
+        if count:
+            print(f"Skipped {count} {name} rows without {spotify_schema.entities[name]['key']}")
+    frames = []
+    for name, spec in spotify_schema.entities.items():
+        df = pd.DataFrame(buffers[name], copy=False)
+        for column in spec['dates']:
+            # Release dates can be just a year or year-month
+            df[column] = pd.to_datetime(df[column], format='ISO8601')
+        frames.append(df)
+    return tuple(frames)
+
+def transform_and_load(s3, data):
+    """Write the songs, album and artist CSVs of one raw playlist file."""
+    album_df, artist_df, song_df = transform(data)
+    
+    songs_key = "transformed_data/songs_data/songs_transformed_" + str(datetime.now()) + ".csv"
+    song_buffer=StringIO()
+    song_df.to_csv(song_buffer, index=False)
+    song_content = song_buffer.getvalue()
+    s3.put_object(Bucket=Bucket, Key=songs_key, Body=song_content)
     
-def artist(data):
-    artist_list = []
-    for row in data['items']:
-        for key, value in row.items():
-            if key == "track":
-                for artist in value['artists']:
-                    artist_dict = {'artist_id':artist['id'], 'artist_name':artist['name'], 'external_url': artist['href']}
-                    artist_list.append(artist_dict)
-    return artist_list
+    album_key = "transformed_data/album_data/album_transformed_" + str(datetime.now()) + ".csv"
+    album_buffer=StringIO()
+    album_df.to_csv(album_buffer, index=False)
+    album_content = album_buffer.getvalue()
+    s3.put_object(Bucket=Bucket, Key=album_key, Body=album_content)
     
-def songs(data):
-    song_list = []
-    for row in data['items']:
-        song_id = row['track']['id']
-        song_name = row['track']['name']
-        song_duration = row['track']['duration_ms']
-        song_url = row['track']['external_urls']['spotify']
-        song_popularity = row['track']['popularity']
-        song_added = row['added_at']
-        album_id = row['track']['album']['id']
-        artist_id = row['track']['album']['artists'][0]['id']
-        song_element = {'song_id':song_id,'song_name':song_name,'duration_ms':song_duration,'url':song_url,
-                        'popularity':song_popularity,'song_added':song_added,'album_id':album_id,
-                        'artist_id':artist_id
-                       }
-        song_list.append(song_element)
-        
-    return song_list
+    artist_key = "transformed_data/artist_data/artist_transformed_" + str(datetime.now()) + ".csv"
+    artist_buffer=StringIO()
+    artist_df.to_csv(artist_buffer, index=False)
+    artist_content = artist_buffer.getvalue()
+    s3.put_object(Bucket=Bucket, Key=artist_key, Body=artist_content)
     
+def load_consolidated(s3, frames, run_time):
+    """Write one Parquet object per entity for every file transformed in this run.
+
+    frames holds the (album_df, artist_df, song_df) of each file. Albums,
+    artists and songs are deduplicated across all of them, so a backlog of N
+    files yields three objects rather than 3N with repeated rows.
+    """
+    if not frames:
+        return
+    partition = "date=" + run_time.strftime("%Y-%m-%d") + "/" if partition_by_date else ""
+    for (name, spec), entity_frames in zip(spotify_schema.entities.items(), zip(*frames)):
+        df = pd.concat(entity_frames, ignore_index=True).drop_duplicates(subset=[spec['key']])
+        key = ("transformed_data/" + name + "_data/" + partition + name + "_transformed_"
+               + run_time.strftime("%Y%m%dT%H%M%S%f") + ".parquet")
+        buffer = BytesIO()
+        df.to_parquet(buffer, index=False)
+        s3.put_object(Bucket=Bucket, Key=key, Body=buffer.getvalue())
+    
+def archive_raw_files(s3, bucket, keys, workers=max_workers):
+    """Move keys to processed_prefix. Returns {key: status}, 'archived' on success.
+
+    Server-side copies run concurrently; the sources that copied are then
+    deleted with delete_objects in batches of 1000 keys.
+    """
+    status = {}
+    def copy(file_key):
+        s3.copy_object(Bucket=bucket, Key=processed_prefix + file_key.split("/")[-1],
+                       CopySource={'Bucket': bucket, 'Key': file_key})
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(copy, file_key): file_key for file_key in keys}
+        for future in as_completed(futures):
+            error = future.exception()
+            if error is None:
+                status[futures[future]] = 'copied'
+            elif getattr(error, 'response', {}).get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                status[futures[future]] = 'missing'  # Archived by an earlier run after all
+            else:
+                status[futures[future]] = "copy failed: " + str(error)
+    
+    copied = [file_key for file_key in keys if status[file_key] == 'copied']
+    for start in range(0, len(copied), 1000):
+        batch = copied[start:start + 1000]
+        try:
+            response = s3.delete_objects(Bucket=bucket, Delete={'Objects': [{'Key': k} for k in batch], 'Quiet': True})
+        except Exception as e:
+            status.update((file_key, "delete failed: " + str(e)) for file_key in batch)
+            continue
+        status.update((file_key, 'archived') for file_key in batch)
+        for error in response.get('Errors', []):
+            status[error['Key']] = "delete failed: " + error.get('Code', '')
+    return status
+
+def read_ledger(s3, bucket):
+    keys = []
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=archive_ledger):
+        keys.extend(obj['Key'][len(archive_ledger):] for obj in page.get('Contents', []))
+    return keys
+
+def record_pending(s3, bucket, keys, workers=max_workers):
+    """Add keys to the ledger, as soon as their transformed output is written.
+
+    One small object per key, so recording a file costs the same however
+    long the backlog is.
+    """
+    def put(file_key):
+        s3.put_object(Bucket=bucket, Key=archive_ledger + file_key, Body=b"")
+    if len(keys) == 1:
+        put(keys[0])
+        return
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(put, keys))
+
+def clear_ledger(s3, bucket, keys):
+    """Remove archived keys from the ledger. A marker left behind only costs a 'missing' copy next run."""
+    for start in range(0, len(keys), 1000):
+        batch = keys[start:start + 1000]
+        try:
+            s3.delete_objects(Bucket=bucket, Delete={'Objects': [{'Key': archive_ledger + k} for k in batch], 'Quiet': True})
+        except Exception as e:
+            print(f"Could not clear {len(batch)} ledger entries: {e}")
+
 def lambda_handler(event, context):
     s3 = boto3.client('s3')
-    Bucket = "spotify-etl-project-darshil"
-    Key = "raw_data/to_processed/"
     
-    spotify_data = []
+    # Files an earlier run transformed but could not archive are archived, not transformed again
+    pending = read_ledger(s3, Bucket)
+    skip = set(pending)
+    
+    # Each file is transformed as soon as it has downloaded, and put on the ledger
+    # right after its output is written, so a timeout cannot get it transformed twice
     spotify_keys = []
-    for file in s3.list_objects(Bucket=Bucket, Prefix=Key)['Contents']:
-        file_key = file['Key']
-        if file_key.split('.')[-1] == "json":
-            response = s3.get_object(Bucket = Bucket, Key = file_key)
-            content = response['Body']
-            jsonObject = json.loads(content.read())
-            spotify_data.append(jsonObject)
-            spotify_keys.append(file_key)
-            
-    for data in spotify_data:
-        album_list = album(data)
-        artist_list = artist(data)
-        song_list = songs(data)
-        
-        album_df = pd.DataFrame.from_dict(album_list)
-        album_df = album_df.drop_duplicates(subset=['album_id'])
-        
-        artist_df = pd.DataFrame.from_dict(artist_list)
-        artist_df = artist_df.drop_duplicates(subset=['artist_id'])
-        
-        #Song Dataframe
-        song_df = pd.DataFrame.from_dict(song_list)
-        
-        album_df['release_date'] = pd.to_datetime(album_df['release_date'])
-        song_df['song_added'] =  pd.to_datetime(song_df['song_added'])
-        
-        songs_key = "transformed_data/songs_data/songs_transformed_" + str(datetime.now()) + ".csv"
-        song_buffer=StringIO()
-        song_df.to_csv(song_buffer, index=False)
-        song_content = song_buffer.getvalue()
-        s3.put_object(Bucket=Bucket, Key=songs_key, Body=song_content)
-        
-        album_key = "transformed_data/album_data/album_transformed_" + str(datetime.now()) + ".csv"
-        album_buffer=StringIO()
-        album_df.to_csv(album_buffer, index=False)
-        album_content = album_buffer.getvalue()
-        s3.put_object(Bucket=Bucket, Key=album_key, Body=album_content)
-        
-        artist_key = "transformed_data/artist_data/artist_transformed_" + str(datetime.now()) + ".csv"
-        artist_buffer=StringIO()
-        artist_df.to_csv(artist_buffer, index=False)
-        artist_content = artist_buffer.getvalue()
-        s3.put_object(Bucket=Bucket, Key=artist_key, Body=artist_content)
-        
-    s3_resource = boto3.resource('s3')
-    for key in spotify_keys:
-        copy_source = {
-            'Bucket': Bucket,
-            'Key': key
-        }
-        s3_resource.meta.client.copy(copy_source, Bucket, 'raw_data/processed/' + key.split("/")[-1])    
-        s3_resource.Object(Bucket, key).delete()
\ No newline at end of file
+    fetched_keys = []
+    frames = []
+    try:
+        for file_key, data in iter_playlists(s3, Bucket, (k for k in list_raw_keys(s3, Bucket, Key) if k not in skip)):
+            if output_mode == 'consolidated':
+                frames.append(transform(data))
+                fetched_keys.append(file_key)
+            else:
+                transform_and_load(s3, data)
+                record_pending(s3, Bucket, [file_key])
+                spotify_keys.append(file_key)
+            if context is not None and context.get_remaining_time_in_millis() < time_margin_ms:
+                print("Stopping before the Lambda timeout; the remaining files wait for the next run")
+                break
+        load_consolidated(s3, frames, datetime.now())
+        if fetched_keys:
+            record_pending(s3, Bucket, fetched_keys)
+        spotify_keys.extend(fetched_keys)
+    except Exception as e:
+        # Logged here in case archiving below fails as well and replaces it
+        print(f"Transform failed after {len(spotify_keys)} files: {e!r}")
+        raise
+    finally:
+        # Archive whatever was written, even if a later file failed
+        status = archive_raw_files(s3, Bucket, pending + spotify_keys)
+        clear_ledger(s3, Bucket, [file_key for file_key, result in status.items() if result in ('archived', 'missing')])
+        unfinished = [file_key for file_key, result in status.items() if result not in ('archived', 'missing')]
+        for file_key in unfinished:
+            print(f"Could not archive {file_key}: {status[file_key]}")
+    
+    return {'transformed': len(spotify_keys), 'archived': len(status) - len(unfinished), 'pending': len(unfinished)}
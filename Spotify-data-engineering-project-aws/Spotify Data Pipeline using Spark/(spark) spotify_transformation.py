@@ -5,76 +5,80 @@ from awsglue.utils import getResolvedOptions
 from pyspark.context import SparkContext
 from awsglue.context import GlueContext
 from awsglue.job import Job
-from pyspark.sql.functions import explode, col, to_date
+from pyspark.sql.functions import explode, col, struct, to_date
+from pyspark.sql import DataFrame
+from pyspark.sql.utils import AnalysisException
 from datetime import datetime
+from functools import reduce
 from awsglue.dynamicframe import DynamicFrame
+# Shipped with the job through --extra-py-files
+import spotify_schema
+
+args = getResolvedOptions(sys.argv, ['JOB_NAME'])
+# --incremental true appends only unseen keys to Parquet tables under incremental_path.
+# Run it with job bookmarks enabled so each run reads only the files added since the last one.
+incremental = ('--incremental' in sys.argv
+               and getResolvedOptions(sys.argv, ['incremental'])['incremental'] == 'true')
 
 sc = SparkContext.getOrCreate()
 glueContext = GlueContext(sc)
 spark = glueContext.spark_session
 job = Job(glueContext)
+job.init(args['JOB_NAME'], args)
 
 s3_path = "s3://spotify-daily-data-project/raw_data/to_processed/"
+incremental_path = "s3://spotify-daily-data-project/transformed_data/incremental/"
 source_dyf = glueContext.create_dynamic_frame_from_options(
     connection_type="s3",
     connection_options={"paths":[s3_path]},
-    format="json"
+    format="json",
+    # Lets the job bookmark remember which files were read
+    transformation_ctx="source_dyf"
 )
 
 spotify_df = source_dyf.toDF()
-def process_albums(df):
-    df = df.withColumn("items", explode("items")).select(
-        col("items.track.album.id").alias("album_id"),
-        col("items.track.album.name").alias("album_name"),
-        col("items.track.album.release_date").alias("release_date"),
-        col("items.track.album.total_tracks").alias("total_tracks"),
-        col("items.track.album.external_urls.spotify").alias("url")
-    ).drop_duplicates(["album_id"])
-    return df
-
-
-def process_artists(df):
-    # First, explode the items to get individual tracks
-    df_items_exploded = df.select(explode(col("items")).alias("item"))
-    
-    # Then, explode the artists array within each item to create a row for each artist
-    df_artists_exploded = df_items_exploded.select(explode(col("item.track.artists")).alias("artist"))
-    
-    # Now, select the artist attributes, ensuring each artist is in its own row
-    df_artists = df_artists_exploded.select(
-        col("artist.id").alias("artist_id"),
-        col("artist.name").alias("artist_name"),
-        col("artist.external_urls.spotify").alias("external_url")
-    ).drop_duplicates(["artist_id"])
-    
-    return df_artists
+def field(base, path):
+    # Column at a spotify_schema field path under the struct column base
+    column = col(base)
+    for part in spotify_schema.split_path(path):
+        column = column[part]
+    return column
 
 
-def process_songs(df):
-    # Explode the items array to create a row for each song
-    df_exploded = df.select(explode(col("items")).alias("item"))
+def item_frames(df):
+    # One DataFrame per raw file shape, each with a row per playlist item in an "element" column.
+    # Playlist files hold their items in an items array; the extractor's NDJSON files
+    # (spotify_raw_*.ndjson.gz) already have one item per row, so those rows are the element.
+    frames = []
+    if "items" in df.columns:
+        frames.append(df.select(explode(col("items")).alias("element")))
+    if "track" in df.columns:
+        rows = df.where(col("items").isNull()) if "items" in df.columns else df
+        frames.append(rows.select(struct(*[col(c) for c in df.columns if c != "items"]).alias("element")))
+    return frames
+
+
+def process_entity(items_dfs, name):
+    # items_dfs come from item_frames; with "each" explode to a row per element of that list
+    spec = spotify_schema.entities[name]
+    selected = []
+    for df_exploded in items_dfs:
+        if spec['each']:
+            df_exploded = df_exploded.select(explode(field("element", spec['each'])).alias("element"))
+        selected.append(df_exploded.select(
+            *[field("element", path).alias(column) for column, path in spec['fields']]
+        ))
     
-    # Extract song information from the exploded DataFrame
-    df_songs = df_exploded.select(
-        col("item.track.id").alias("song_id"),
-        col("item.track.name").alias("song_name"),
-        col("item.track.duration_ms").alias("duration_ms"),
-        col("item.track.external_urls.spotify").alias("url"),
-        col("item.track.popularity").alias("popularity"),
-        col("item.added_at").alias("song_added"),
-        col("item.track.album.id").alias("album_id"),
-        col("item.track.artists")[0]["id"].alias("artist_id")
-    ).drop_duplicates(["song_id"])
+    # The element structs of the two shapes differ, so they are combined once flattened to columns.
+    # Rows without a key (a null track, a local file) would all collapse into one null row
+    df_entity = reduce(DataFrame.unionByName, selected).where(
+        col(spec['key']).isNotNull()).drop_duplicates([spec['key']])
     
-    # Convert string dates in 'song_added' to actual date types
-    df_songs = df_songs.withColumn("song_added", to_date(col("song_added")))
+    # Convert string dates to actual date types
+    for column in spec['dates']:
+        df_entity = df_entity.withColumn(column, to_date(col(column)))
     
-    return df_songs
-
-#process data
-album_df = process_albums(spotify_df)
-artist_df = process_artists(spotify_df)
-song_df = process_songs(spotify_df)
+    return df_entity
 
 
 def write_to_s3(df, path_suffix, format_type="csv"):
@@ -88,9 +92,36 @@ def write_to_s3(df, path_suffix, format_type="csv"):
         format = format_type
     )
 
-#write data to s3   
-write_to_s3(album_df, "album/album_transformed_{}".format(datetime.now().strftime("%Y-%m-%d")), "csv")
-write_to_s3(artist_df, "artist/artist_transformed_{}".format(datetime.now().strftime("%Y-%m-%d")), "csv")
-write_to_s3(song_df, "songs/songs_transformed_{}".format(datetime.now().strftime("%Y-%m-%d")), "csv")
 
-job.commit()
\ No newline at end of file
+def merge_new(df, name):
+    # Keep only rows whose key is not in the table yet. Parquet lets this read just the key column,
+    # and it also makes a rerun after a failed commit harmless.
+    key = spotify_schema.entities[name]['key']
+    try:
+        existing = spark.read.parquet(incremental_path + name).select(key)
+    except AnalysisException:
+        # First run, nothing written yet
+        return df
+    return df.join(existing, on=key, how="left_anti")
+
+
+# With bookmarks there may be no new files, and then no columns at all
+items_dfs = item_frames(spotify_df)
+if items_dfs:
+    # Build the items once and reuse them for all three entities
+    items_dfs = [df.cache() for df in items_dfs]
+    
+    #process data
+    frames = {name: process_entity(items_dfs, name) for name in spotify_schema.entities}
+    
+    #write data to s3
+    for name, df in frames.items():
+        if incremental:
+            merge_new(df, name).write.mode("append").parquet(incremental_path + name)
+        else:
+            write_to_s3(df, "{0}/{0}_transformed_{1}".format(name, datetime.now().strftime("%Y-%m-%d")), "csv")
+    
+    for df in items_dfs:
+        df.unpersist()
+
+job.commit()
@@ -1,30 +1,229 @@
+import gzip
 import json
 import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from io import BytesIO
+import requests
 import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials
 import boto3
 from datetime import datetime
 
+Bucket = "spotify-etl-project-darshil"
+# Playlists pulled every run, comma separated; an event's "playlist_ids" list overrides them
+playlist_ids = os.environ.get('SPOTIFY_PLAYLIST_IDS', "37i9dQZEVXbNG2KDcFcKOF").split(',')
+# API requests in flight at once, across all playlists
+max_workers = int(os.environ.get('SPOTIFY_API_WORKERS', 8))
+# The most tracks the playlist items endpoint returns per request
+page_size = 100
+retries = 5
+max_backoff = 30.0
+# One manifest per run, describing its raw object; kept out of raw_data/to_processed/
+manifest_prefix = "raw_data/manifests/"
+# Each playlist's last snapshot_id and added_at high-water mark, so runs only store what changed
+state_key = "raw_data/state/playlist_state.json"
+# Ignore the state and store every playlist in full (an event's "full_refresh" does the same)
+full_refresh = os.environ.get('SPOTIFY_FULL_REFRESH', '0') == '1'
+
+class RateLimiter:
+    """Pause shared by every worker: a 429 holds back all requests until its Retry-After has passed."""
+
+    def __init__(self):
+        self.resume_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        delay = self.resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        with self._lock:
+            self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+
+def make_client(workers=max_workers):
+    """Spotify client sharing one pooled session between worker threads.
+
+    spotipy's own retries are left out, so fetch_page sees each 429 with its
+    Retry-After header. SPOTIFY_API_URL and SPOTIFY_TOKEN_URL point the
+    client at a local stub of the API.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=workers)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    client_credentials_manager = SpotifyClientCredentials(client_id=os.environ.get('client_id'),
+                                                          client_secret=os.environ.get('client_secret'),
+                                                          requests_session=session)
+    if 'SPOTIFY_TOKEN_URL' in os.environ:
+        client_credentials_manager.OAUTH_TOKEN_URL = os.environ['SPOTIFY_TOKEN_URL']
+    # Fetch the token once up front rather than from every worker at the same time
+    client_credentials_manager.get_access_token(as_dict=False)
+
+    sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager, requests_session=session)
+    if 'SPOTIFY_API_URL' in os.environ:
+        sp.prefix = os.environ['SPOTIFY_API_URL']
+    return sp
+
+def call_api(limiter, func, *args, **kwargs):
+    """func(*args, **kwargs), retrying rate limits, server errors and dropped connections."""
+    for attempt in range(retries + 1):
+        limiter.wait()
+        try:
+            return func(*args, **kwargs)
+        except spotipy.SpotifyException as e:
+            status = e.http_status or 0
+            if attempt == retries or (status != 429 and status < 500):
+                raise
+            retry_after = e.headers.get('Retry-After')
+        except requests.exceptions.RequestException:
+            if attempt == retries:
+                raise
+            status, retry_after = 0, None
+        delay = float(retry_after) if retry_after else min(max_backoff, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0)
+        if status == 429:
+            limiter.pause(delay)
+        else:
+            time.sleep(delay)
+
+def fetch_page(sp, limiter, playlist_id, offset):
+    return call_api(limiter, sp.playlist_items, playlist_id, limit=page_size, offset=offset, additional_types=("track",))
+
+def fetch_snapshot(sp, limiter, playlist_id):
+    """(snapshot_id, track count) of a playlist, without any of its tracks."""
+    playlist = call_api(limiter, sp.playlist, playlist_id, fields="snapshot_id,tracks.total")
+    return playlist['snapshot_id'], playlist['tracks']['total']
+
+def track_id(item):
+    return (item.get('track') or {}).get('id')
+
+def new_items(items, entry):
+    """Items added since the high-water mark in a playlist's state entry, and its updated entry.
+
+    The mark is the newest added_at seen, along with the ids of the tracks
+    added at exactly that time, so a track added in the same second as the
+    mark is still picked up. Items without an added_at are always kept.
+    """
+    mark = entry.get('added_at') or ""
+    at_mark = set(entry.get('ids_at_mark', []))
+    fresh = [item for item in items
+             if not item.get('added_at') or item['added_at'] > mark
+             or (item['added_at'] == mark and track_id(item) not in at_mark)]
+
+    newest = max([item['added_at'] for item in items if item.get('added_at')] + [mark])
+    ids_at_newest = {track_id(item) for item in items if item.get('added_at') == newest}
+    if newest == mark:
+        ids_at_newest |= at_mark
+    return fresh, {'added_at': newest, 'ids_at_mark': sorted(i for i in ids_at_newest if i)}
+
+def extract_playlists(sp, ids, state=None, workers=max_workers):
+    """New tracks of every changed playlist, paged concurrently.
+
+    A playlist whose snapshot_id matches its entry in state is skipped
+    without fetching any tracks. Returns (tracks, failed, unchanged, state):
+    {id: new items}, {id: error}, [ids], and the updated state.
+    """
+    state = dict(state or {})
+    limiter = RateLimiter()
+    pages = {}
+    failed = {}
+    snapshots = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # A playlist's pages are all queued as soon as its snapshot shows it changed
+        snapshot_futures = {pool.submit(fetch_snapshot, sp, limiter, playlist_id): playlist_id for playlist_id in ids}
+        page_futures = {}
+        for future in as_completed(snapshot_futures):
+            playlist_id = snapshot_futures[future]
+            try:
+                snapshot_id, total = future.result()
+            except Exception as e:
+                failed[playlist_id] = str(e)
+                continue
+            if state.get(playlist_id, {}).get('snapshot_id') == snapshot_id:
+                continue
+            snapshots[playlist_id] = snapshot_id
+            pages[playlist_id] = {}
+            for offset in range(0, total, page_size):
+                page_futures[pool.submit(fetch_page, sp, limiter, playlist_id, offset)] = (playlist_id, offset)
+
+        for future in as_completed(page_futures):
+            playlist_id, offset = page_futures[future]
+            try:
+                pages[playlist_id][offset] = future.result()['items']
+            except Exception as e:
+                failed[playlist_id] = str(e)
+
+    unchanged = [playlist_id for playlist_id in ids if playlist_id not in failed and playlist_id not in pages]
+    tracks = {}
+    # A playlist missing a page is left out entirely, and its state kept, rather than stored half-fetched
+    for playlist_id, by_offset in pages.items():
+        if playlist_id in failed:
+            continue
+        items = [item for offset in sorted(by_offset) for item in by_offset[offset]]
+        tracks[playlist_id], entry = new_items(items, state.get(playlist_id, {}))
+        state[playlist_id] = dict(entry, snapshot_id=snapshots[playlist_id])
+    return tracks, failed, unchanged, state
+
+def to_ndjson_gz(tracks):
+    """Gzipped JSON lines, one playlist item per line tagged with its playlist_id."""
+    buffer = BytesIO()
+    # Level 6 is within a few percent of 9 on this data at a fifth of the CPU
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=6) as file:
+        for playlist_id, items in tracks.items():
+            for item in items:
+                item['playlist_id'] = playlist_id
+                file.write(json.dumps(item).encode() + b"\n")
+    return buffer.getvalue()
+
+def read_state(s3):
+    try:
+        return json.loads(s3.get_object(Bucket=Bucket, Key=state_key)['Body'].read())
+    except s3.exceptions.NoSuchKey:
+        return {}
+
 def lambda_handler(event, context):
-    
-    cilent_id = os.environ.get('client_id')
-    client_secret = os.environ.get('client_secret')
-    
-    client_credentials_manager = SpotifyClientCredentials(client_id=cilent_id, client_secret=client_secret)
-    sp = spotipy.Spotify(client_credentials_manager = client_credentials_manager)
-    playlists = sp.user_playlists('spotify')
-    
-    playlist_link = "https://open.spotify.com/playlist/37i9dQZEVXbNG2KDcFcKOF?si=1333723a6eff4b7f"
-    playlist_URI = playlist_link.split("/")[-1].split("?")[0]
-    
-    spotify_data = sp.playlist_tracks(playlist_URI)   
-    
+    event = event or {}
+    ids = event.get('playlist_ids') or playlist_ids
+    sp = make_client()
     cilent = boto3.client('s3')
-    
-    filename = "spotify_raw_" + str(datetime.now()) + ".json"
-    
+
+    state = {} if full_refresh or event.get('full_refresh') else read_state(cilent)
+    tracks, failed, unchanged, new_state = extract_playlists(sp, ids, state)
+    for playlist_id, error in failed.items():
+        print(f"Could not extract playlist {playlist_id}: {error}")
+    if failed and not tracks and not unchanged:
+        raise RuntimeError(f"No playlist could be extracted ({len(failed)} failed)")
+
+    run_time = str(datetime.now())
+    manifest = {
+        'run_time': run_time,
+        'key': None,
+        'bytes': 0,
+        'tracks': sum(len(items) for items in tracks.values()),
+        'playlists': {playlist_id: len(items) for playlist_id, items in tracks.items()},
+        'unchanged': unchanged,
+        'failed': failed,
+    }
+    # Nothing new leaves no raw object for the transform to pick up
+    if manifest['tracks']:
+        filename = "spotify_raw_" + run_time + ".ndjson.gz"
+        body = to_ndjson_gz(tracks)
+        cilent.put_object(
+            Bucket=Bucket,
+            Key="raw_data/to_processed/" + filename,
+            Body=body
+            )
+        manifest.update(key="raw_data/to_processed/" + filename, bytes=len(body))
+
+    # Saved only once the raw object is stored, so a failed run is fetched again next time
+    cilent.put_object(Bucket=Bucket, Key=state_key, Body=json.dumps(new_state))
     cilent.put_object(
-        Bucket="spotify-etl-project-darshil",
-        Key="raw_data/to_processed/" + filename,
-        Body=json.dumps(spotify_data)
+        Bucket=Bucket,
+        Key=manifest_prefix + "spotify_raw_" + run_time + ".json",
+        Body=json.dumps(manifest)
         )
+    return manifest
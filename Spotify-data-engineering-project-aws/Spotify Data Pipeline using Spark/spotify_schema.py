@@ -0,0 +1,52 @@
+# Column mapping from a raw playlist file to the album, artist and songs tables,
+# shared by the transform Lambda and the Glue job (pass this file to Glue with
+# --extra-py-files). Adding a column is one line here.
+#
+# Each entity reads one row per playlist item, or with "each" one row per
+# element of that list inside the item. Field paths are dot separated; a number
+# indexes a list, so "track.album.artists.0.id" is the album's first artist.
+
+entities = {
+    'album': {
+        'each': None,
+        'fields': [
+            ('album_id', 'track.album.id'),
+            ('name', 'track.album.name'),
+            ('release_date', 'track.album.release_date'),
+            ('total_tracks', 'track.album.total_tracks'),
+            ('url', 'track.album.external_urls.spotify'),
+        ],
+        'key': 'album_id',
+        'dates': ['release_date'],
+    },
+    'artist': {
+        'each': 'track.artists',
+        'fields': [
+            ('artist_id', 'id'),
+            ('artist_name', 'name'),
+            ('external_url', 'href'),
+        ],
+        'key': 'artist_id',
+        'dates': [],
+    },
+    'songs': {
+        'each': None,
+        'fields': [
+            ('song_id', 'track.id'),
+            ('song_name', 'track.name'),
+            ('duration_ms', 'track.duration_ms'),
+            ('url', 'track.external_urls.spotify'),
+            ('popularity', 'track.popularity'),
+            ('song_added', 'added_at'),
+            ('album_id', 'track.album.id'),
+            ('artist_id', 'track.album.artists.0.id'),
+        ],
+        'key': 'song_id',
+        'dates': ['song_added'],
+    },
+}
+
+
+def split_path(path):
+    """'track.album.artists.0.id' -> ('track', 'album', 'artists', 0, 'id')"""
+    return tuple(int(part) if part.isdigit() else part for part in path.split('.'))
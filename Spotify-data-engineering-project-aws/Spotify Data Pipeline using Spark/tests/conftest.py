@@ -0,0 +1,97 @@
+"""Fixtures loading the two Lambda handlers against moto's stand-in for S3.
+
+Needs pytest, moto, boto3, pandas and pyarrow. spotipy is taken from the
+Lambda layer zip when it is not installed. Run from the project folder with
+``python -m pytest tests``.
+"""
+import gzip
+import importlib.util
+import json
+import os
+import sys
+
+import boto3
+import pytest
+from moto import mock_aws
+
+project = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# spotify_schema is packaged next to the handlers
+sys.path.insert(0, project)
+try:
+    import spotipy  # noqa: F401
+except ImportError:
+    # Appended, so the installed requests is used rather than the layer's
+    sys.path.append(os.path.join(project, 'spotipy_layer.zip', 'python'))
+
+
+def load_module(name, filename):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(project, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    for name, value in (('AWS_ACCESS_KEY_ID', 'testing'), ('AWS_SECRET_ACCESS_KEY', 'testing'),
+                        ('AWS_SESSION_TOKEN', 'testing'), ('AWS_DEFAULT_REGION', 'us-east-1')):
+        monkeypatch.setenv(name, value)
+    with mock_aws():
+        yield boto3.client('s3')
+
+
+@pytest.fixture
+def transform(s3):
+    module = load_module('spotify_transformation_load_function', '(python) spotify_transformation_load_function.py')
+    s3.create_bucket(Bucket=module.Bucket)
+    return module
+
+
+@pytest.fixture
+def extract(s3):
+    module = load_module('spotify_api_data_extract', 'spotify_api_data_extract.py')
+    s3.create_bucket(Bucket=module.Bucket)
+    return module
+
+
+def make_item(track_id, album_id='al0', artist_ids=('ar0',), added_at='2024-05-01T10:00:00Z'):
+    """A playlist item carrying every field spotify_schema reads."""
+    artists = [{'id': artist_id, 'name': f'Artist {artist_id}', 'href': f'https://api.spotify.com/v1/artists/{artist_id}'}
+               for artist_id in artist_ids]
+    return {
+        'added_at': added_at,
+        'track': {
+            'id': track_id,
+            'name': f'Song {track_id}',
+            'duration_ms': 200000,
+            'popularity': 50,
+            'external_urls': {'spotify': f'https://open.spotify.com/track/{track_id}'},
+            'artists': artists,
+            'album': {
+                'id': album_id,
+                'name': f'Album {album_id}',
+                'release_date': '2023-11-01',
+                'total_tracks': 12,
+                'external_urls': {'spotify': f'https://open.spotify.com/album/{album_id}'},
+                'artists': artists[:1],
+            },
+        },
+    }
+
+
+def put_playlist(s3, bucket, key, items):
+    """Raw file in the playlist shape, as the extractor used to write it."""
+    s3.put_object(Bucket=bucket, Key=key, Body=json.dumps({'items': items}))
+
+
+def put_ndjson(s3, bucket, key, items):
+    """Raw file in the extractor's gzipped NDJSON shape, one item per line."""
+    body = gzip.compress(b''.join(json.dumps(item).encode() + b'\n' for item in items))
+    s3.put_object(Bucket=bucket, Key=key, Body=body)
+
+
+def list_keys(s3, bucket, prefix):
+    keys = []
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        keys.extend(obj['Key'] for obj in page.get('Contents', []))
+    return sorted(keys)
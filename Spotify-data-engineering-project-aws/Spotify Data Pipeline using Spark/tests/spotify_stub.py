@@ -0,0 +1,85 @@
+"""Local HTTP stand-in for the parts of the Spotify Web API the extractor calls."""
+import json
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from conftest import make_item
+
+
+class SpotifyStub:
+    """Serves the token endpoint, playlist snapshots and paged playlist items.
+
+    playlists maps a playlist id to its track count; the i-th track of
+    playlist p has id "p_t<i>" and was added i seconds after 2024-01-01.
+    With throttle set, the first request for every URL is answered with a
+    429 and a Retry-After of throttle seconds.
+    """
+
+    def __init__(self, playlists, throttle=None):
+        self.playlists = dict(playlists)
+        self.snapshots = {}
+        self.throttle = throttle
+        self.requests = []
+        self.throttled = 0
+        self._seen = set()
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def item(self, playlist_id, i):
+        added_at = (datetime(2024, 1, 1) + timedelta(seconds=i)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        return make_item(f'{playlist_id}_t{i}', f'al{i % 7}', (f'ar{i % 5}',), added_at)
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def send(self, status, body, headers=()):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                self.send(200, {'access_token': 'token', 'token_type': 'Bearer', 'expires_in': 3600})
+
+            def do_GET(self):
+                with stub._lock:
+                    stub.requests.append(self.path)
+                    first = self.path not in stub._seen
+                    stub._seen.add(self.path)
+                if stub.throttle is not None and first:
+                    with stub._lock:
+                        stub.throttled += 1
+                    return self.send(429, {'error': {'status': 429, 'message': 'API rate limit exceeded'}},
+                                     [('Retry-After', str(stub.throttle))])
+                url = urlparse(self.path)
+                parts = url.path.strip('/').split('/')  # v1, playlists, id[, tracks]
+                playlist_id = parts[2]
+                if playlist_id not in stub.playlists:
+                    return self.send(404, {'error': {'status': 404, 'message': 'Resource not found'}})
+                total = stub.playlists[playlist_id]
+                if len(parts) == 3:
+                    return self.send(200, {'snapshot_id': stub.snapshots.get(playlist_id, 'snapshot-1'),
+                                           'tracks': {'total': total}})
+                query = parse_qs(url.query)
+                offset, limit = int(query['offset'][0]), int(query['limit'][0])
+                items = [stub.item(playlist_id, i) for i in range(offset, min(offset + limit, total))]
+                self.send(200, {'items': items, 'total': total, 'limit': limit, 'offset': offset, 'next': None})
+
+        return Handler
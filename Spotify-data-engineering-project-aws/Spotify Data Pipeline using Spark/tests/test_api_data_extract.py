@@ -0,0 +1,90 @@
+import gzip
+import json
+
+import pytest
+
+from conftest import list_keys
+from spotify_stub import SpotifyStub
+
+
+@pytest.fixture
+def spotify(monkeypatch, tmp_path):
+    # spotipy caches the token in a .cache file in the working directory
+    monkeypatch.chdir(tmp_path)
+    stub = SpotifyStub({'pl0': 250, 'pl1': 100, 'pl2': 7})
+    monkeypatch.setenv('SPOTIFY_API_URL', stub.url + '/v1/')
+    monkeypatch.setenv('SPOTIFY_TOKEN_URL', stub.url + '/api/token')
+    monkeypatch.setenv('client_id', 'id')
+    monkeypatch.setenv('client_secret', 'secret')
+    yield stub
+    stub.close()
+
+
+def run(extract, s3, spotify, **event):
+    manifest = extract.lambda_handler(dict(event, playlist_ids=list(spotify.playlists) + ['missing']), None)
+    items = []
+    if manifest['key']:
+        body = s3.get_object(Bucket=extract.Bucket, Key=manifest['key'])['Body'].read()
+        items = [json.loads(line) for line in gzip.decompress(body).splitlines()]
+    return manifest, items
+
+
+def track_ids(items):
+    return sorted(item['track']['id'] for item in items)
+
+
+def all_tracks(spotify):
+    return sorted(f'{p}_t{i}' for p, total in spotify.playlists.items() for i in range(total))
+
+
+def test_pages_every_playlist_into_one_ndjson_object(extract, s3, spotify):
+    manifest, items = run(extract, s3, spotify)
+
+    assert track_ids(items) == all_tracks(spotify)
+    assert all(item['playlist_id'] == item['track']['id'].split('_')[0] for item in items)
+    assert manifest['key'].startswith('raw_data/to_processed/spotify_raw_') and manifest['key'].endswith('.ndjson.gz')
+    assert manifest['playlists'] == {'pl0': 250, 'pl1': 100, 'pl2': 7}
+    assert manifest['tracks'] == 357
+    assert list(manifest['failed']) == ['missing']
+    # One request per 100 tracks, after each playlist's snapshot request
+    pages = [path for path in spotify.requests if '/tracks?' in path]
+    assert len(pages) == 3 + 1 + 1
+    assert list_keys(s3, extract.Bucket, extract.manifest_prefix) == [
+        extract.manifest_prefix + manifest['key'].split('/')[-1].replace('.ndjson.gz', '.json')]
+
+
+def test_rate_limited_requests_are_retried(extract, s3, spotify):
+    spotify.throttle = 0.05
+
+    manifest, items = run(extract, s3, spotify)
+
+    assert spotify.throttled > 0
+    assert track_ids(items) == all_tracks(spotify)
+    assert list(manifest['failed']) == ['missing']
+
+
+def test_state_keeps_unchanged_playlists_and_old_tracks_out(extract, s3, spotify):
+    run(extract, s3, spotify)
+
+    manifest, items = run(extract, s3, spotify)
+    assert manifest['key'] is None and items == []
+    assert sorted(manifest['unchanged']) == ['pl0', 'pl1', 'pl2']
+
+    spotify.playlists['pl0'] += 30
+    spotify.snapshots['pl0'] = 'snapshot-2'
+    manifest, items = run(extract, s3, spotify)
+    assert track_ids(items) == sorted(f'pl0_t{i}' for i in range(250, 280))
+    assert sorted(manifest['unchanged']) == ['pl1', 'pl2']
+
+    manifest, items = run(extract, s3, spotify, full_refresh=True)
+    assert track_ids(items) == all_tracks(spotify)
+
+
+def test_extracted_objects_feed_the_transform(extract, transform, s3, spotify):
+    manifest, _ = run(extract, s3, spotify)
+
+    assert transform.lambda_handler({}, None) == {'transformed': 1, 'archived': 1, 'pending': 0}
+
+    songs = list_keys(s3, transform.Bucket, 'transformed_data/songs_data/')
+    body = s3.get_object(Bucket=transform.Bucket, Key=songs[0])['Body'].read().decode()
+    assert len(body.splitlines()) == 1 + manifest['tracks']
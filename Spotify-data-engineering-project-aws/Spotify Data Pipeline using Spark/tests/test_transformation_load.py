@@ -0,0 +1,107 @@
+from io import BytesIO, StringIO
+
+import pandas as pd
+import pytest
+
+from conftest import list_keys, make_item, put_ndjson, put_playlist
+
+raw = 'raw_data/to_processed/'
+
+
+class Killed(BaseException):
+    """Stands in for a Lambda timeout, which no except or finally clause sees through."""
+
+
+def read_entity(s3, bucket, name):
+    frames = []
+    for key in list_keys(s3, bucket, 'transformed_data/' + name + '_data/'):
+        body = s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+        frames.append(pd.read_parquet(BytesIO(body)) if key.endswith('.parquet')
+                      else pd.read_csv(StringIO(body.decode())))
+    return pd.concat(frames, ignore_index=True)
+
+
+def test_transforms_playlist_and_ndjson_files(transform, s3):
+    bucket = transform.Bucket
+    put_playlist(s3, bucket, raw + 'spotify_raw_1.json', [make_item(f's{i}', f'al{i % 3}') for i in range(10)])
+    put_ndjson(s3, bucket, raw + 'spotify_raw_2.ndjson.gz', [make_item(f's{i}', f'al{i % 3}') for i in range(10, 20)])
+    s3.put_object(Bucket=bucket, Key=raw + 'notes.txt', Body=b'not a raw file')
+
+    assert transform.lambda_handler({}, None) == {'transformed': 2, 'archived': 2, 'pending': 0}
+
+    assert sorted(read_entity(s3, bucket, 'songs')['song_id']) == sorted(f's{i}' for i in range(20))
+    assert list_keys(s3, bucket, raw) == [raw + 'notes.txt']
+    assert list_keys(s3, bucket, transform.processed_prefix) == [
+        transform.processed_prefix + 'spotify_raw_1.json', transform.processed_prefix + 'spotify_raw_2.ndjson.gz']
+    assert transform.read_ledger(s3, bucket) == []
+
+
+def test_consolidated_mode_deduplicates_across_files(transform, s3, monkeypatch):
+    monkeypatch.setattr(transform, 'output_mode', 'consolidated')
+    bucket = transform.Bucket
+    put_playlist(s3, bucket, raw + 'spotify_raw_1.json', [make_item(f's{i}', 'al0', ('ar0', 'ar1')) for i in range(5)])
+    put_ndjson(s3, bucket, raw + 'spotify_raw_2.ndjson.gz', [make_item(f's{i}', 'al1', ('ar1',)) for i in range(3, 8)])
+
+    assert transform.lambda_handler({}, None)['transformed'] == 2
+
+    for name in ('album', 'artist', 'songs'):
+        assert len(list_keys(s3, bucket, 'transformed_data/' + name + '_data/')) == 1
+    assert sorted(read_entity(s3, bucket, 'album')['album_id']) == ['al0', 'al1']
+    assert sorted(read_entity(s3, bucket, 'artist')['artist_id']) == ['ar0', 'ar1']
+    assert sorted(read_entity(s3, bucket, 'songs')['song_id']) == [f's{i}' for i in range(8)]
+
+
+def test_timed_out_run_is_archived_not_transformed_again(transform, s3, monkeypatch):
+    bucket = transform.Bucket
+    for i in range(6):
+        put_playlist(s3, bucket, raw + f'spotify_raw_{i}.json', [make_item(f's{i}')])
+
+    transform_and_load = transform.transform_and_load
+    done = []
+
+    def dies_on_third_file(s3_client, data):
+        if len(done) == 2:
+            raise Killed()
+        transform_and_load(s3_client, data)
+        done.append(data['items'][0]['track']['id'])
+
+    def killed(*args, **kwargs):
+        raise Killed()
+
+    with monkeypatch.context() as patch, pytest.raises(Killed):
+        patch.setattr(transform, 'transform_and_load', dies_on_third_file)
+        patch.setattr(transform, 'archive_raw_files', killed)
+        transform.lambda_handler({}, None)
+    assert sorted(transform.read_ledger(s3, bucket)) == sorted(raw + f'spotify_raw_{s[1:]}.json' for s in done)
+
+    assert transform.lambda_handler({}, None) == {'transformed': 4, 'archived': 6, 'pending': 0}
+    # One CSV per raw file: the two transformed before the timeout were not written again
+    assert len(list_keys(s3, bucket, 'transformed_data/songs_data/')) == 6
+    assert list_keys(s3, bucket, raw) == []
+    assert transform.read_ledger(s3, bucket) == []
+
+
+def test_stops_before_the_lambda_timeout(transform, s3):
+    bucket = transform.Bucket
+    for i in range(5):
+        put_playlist(s3, bucket, raw + f'spotify_raw_{i}.json', [make_item(f's{i}')])
+
+    class NearlyOutOfTime:
+        def get_remaining_time_in_millis(self):
+            return transform.time_margin_ms - 1
+
+    assert transform.lambda_handler({}, NearlyOutOfTime()) == {'transformed': 1, 'archived': 1, 'pending': 0}
+    assert len(list_keys(s3, bucket, raw)) == 4
+    assert transform.lambda_handler({}, None)['transformed'] == 4
+
+
+def test_rows_without_a_key_are_skipped(transform):
+    local = make_item(None, None, (None,))
+    items = [make_item('s1', 'al1'), {'added_at': '2024-05-01T10:00:00Z', 'track': None}, local, dict(local)]
+
+    album_df, artist_df, song_df = transform.transform({'items': items})
+
+    assert album_df['album_id'].tolist() == ['al1']
+    assert album_df['total_tracks'].dtype == 'int64'
+    assert artist_df['artist_id'].tolist() == ['ar0']
+    assert song_df['song_id'].tolist() == ['s1']
@@ -0,0 +1,206 @@
+import argparse
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+
+
+class ArchiveWriter:
+    """Append-only, gzip-compressed daily archive of raw breadcrumb messages.
+
+    Messages are buffered and written as one gzip member per flush, so
+    rmsg_YYYYMMDD.json.gz stays a valid gzip file that gzip.open reads as
+    newline-delimited JSON. Every flush also appends "offset length count" to
+    rmsg_YYYYMMDD.idx, fsyncs both files, and rewrites the count sidecar, so a
+    crash loses at most the unflushed buffer. Messages handed in with add() are
+    acked only after the segment holding them is on disk.
+
+    On open, every archive in the directory is cut back to its last indexed
+    segment, so a segment torn or left unindexed by a crash is dropped before
+    anything is appended after it. Its messages were never acked, so Pub/Sub
+    delivers them again.
+    """
+
+    def __init__(self, directory="received_msg", max_bytes=4 * 1024 * 1024, max_seconds=30.0, compresslevel=6):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.compresslevel = compresslevel
+        self.current_day = None
+        self.message_count = 0
+        self._lines = []
+        self._acks = []
+        self._buffered_bytes = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        os.makedirs(directory, exist_ok=True)
+        for name in sorted(os.listdir(directory)):
+            if name.startswith("rmsg_") and name.endswith(".json.gz"):
+                self._recover(name[len("rmsg_"):-len(".json.gz")])
+
+    def paths(self, day):
+        return (os.path.join(self.directory, f"rmsg_{day}.json.gz"),
+                os.path.join(self.directory, f"rmsg_{day}.idx"),
+                os.path.join(self.directory, f"count_{day}.txt"))
+
+    def add(self, data, message=None):
+        """Buffer one decoded message, flushing if the size or time limit is hit."""
+        line = json.dumps(data).encode("utf-8") + b"\n"
+        day = time.strftime("%Y%m%d")
+        with self._lock:
+            if day != self.current_day:
+                # Close out the previous day before the first message of the new one
+                self._flush()
+                self.current_day = day
+                self.message_count = self._read_count(day)
+            self._lines.append(line)
+            if message is not None:
+                self._acks.append(message)
+            self._buffered_bytes += len(line)
+            self.message_count += 1
+            if self._buffered_bytes >= self.max_bytes:
+                self._flush()
+
+    def flush_if_due(self):
+        with self._lock:
+            if self._lines and time.monotonic() - self._last_flush >= self.max_seconds:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def start(self):
+        """Flush on a timer so a quiet stream does not leave messages buffered."""
+        def run():
+            while not self._stopped.wait(1.0):
+                self.flush_if_due()
+        threading.Thread(target=run, name="archive-flusher", daemon=True).start()
+        return self
+
+    def close(self):
+        self._stopped.set()
+        self.flush()
+
+    def _read_count(self, day):
+        """Resume the day's count from the index after a restart."""
+        _, index_path, _ = self.paths(day)
+        return sum(entry[2] for entry in read_index(index_path))
+
+    def _recover(self, day):
+        """Truncate a day's archive and index to their last complete segment and rewrite its count."""
+        archive_path, index_path, _ = self.paths(day)
+        size = os.path.getsize(archive_path) if os.path.exists(archive_path) else 0
+
+        # Keep the index entries that follow on from each other and lie within
+        # the archive; a torn last line or an entry past the end stops the scan
+        index_text = ""
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                index_text = f.read()
+        entries = []
+        end = 0
+        for line in index_text.splitlines(keepends=True):
+            parts = line.split()
+            if not line.endswith("\n") or len(parts) != 3 or not all(part.isdigit() for part in parts):
+                break
+            offset, length, count = (int(part) for part in parts)
+            if offset != end or offset + length > size:
+                break
+            entries.append((offset, length, count))
+            end = offset + length
+
+        if size > end:
+            print(f"Dropping {size - end} unindexed bytes from the end of {archive_path}")
+            with open(archive_path, "r+b") as f:
+                f.truncate(end)
+                f.flush()
+                os.fsync(f.fileno())
+        kept_text = "".join(f"{offset} {length} {count}\n" for offset, length, count in entries)
+        if kept_text != index_text:
+            self._replace(index_path, kept_text)
+        self._write_count(day, sum(entry[2] for entry in entries))
+
+    def _write_count(self, day, count):
+        _, _, count_path = self.paths(day)
+        self._replace(count_path, f"Total messages received on {day}: {count}\n")
+
+    @staticmethod
+    def _replace(path, text):
+        # Replace the file atomically so a reader never sees it torn
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _flush(self):
+        self._last_flush = time.monotonic()
+        if not self._lines:
+            return
+        archive_path, index_path, _ = self.paths(self.current_day)
+        segment = gzip.compress(b"".join(self._lines), compresslevel=self.compresslevel)
+        with open(archive_path, "ab") as f:
+            offset = f.tell()
+            f.write(segment)
+            f.flush()
+            os.fsync(f.fileno())
+        with open(index_path, "a") as f:
+            f.write(f"{offset} {len(segment)} {len(self._lines)}\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._write_count(self.current_day, self.message_count)
+
+        for message in self._acks:
+            message.ack()
+        self._lines.clear()
+        self._acks.clear()
+        self._buffered_bytes = 0
+
+
+def read_index(index_path):
+    """Return the (offset, length, count) entries of an archive index."""
+    if not os.path.exists(index_path):
+        return []
+    entries = []
+    with open(index_path) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3:
+                entries.append(tuple(int(part) for part in parts))
+    return entries
+
+
+def replay(archive_path, start_segment=0):
+    """Yield the raw JSON lines of an archive, optionally skipping segments.
+
+    The index lets a replay start at any segment without decompressing the ones
+    before it. The lines can be passed to processjson.process_json_lines, or
+    piped into "processjson.py -" from this module's command line.
+    """
+    index_path = archive_path[:-len(".json.gz")] + ".idx"
+    entries = read_index(index_path)[start_segment:]
+    with open(archive_path, "rb") as f:
+        for offset, length, _ in entries:
+            f.seek(offset)
+            yield from gzip.decompress(f.read(length)).splitlines(keepends=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write the messages of a daily archive to stdout as JSON lines, "
+                                                 "e.g. to pipe into processjson.py -.")
+    parser.add_argument("archive", help="rmsg_YYYYMMDD.json.gz file with its .idx alongside")
+    parser.add_argument("--start-segment", type=int, default=0, help="Index entry to start from")
+    args = parser.parse_args()
+    out = sys.stdout.buffer
+    for line in replay(args.archive, args.start_segment):
+        out.write(line)
+    out.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import argparse
+import json
+import threading
+import time
+from concurrent import futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import publisher
+
+
+class BreadcrumbStub(BaseHTTPRequestHandler):
+    """Local stand-in for getBreadCrumbs that answers after a fixed delay."""
+    payload = b"[]"
+    delay = 0.05
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self.payload)))
+        self.end_headers()
+        self.wfile.write(self.payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakePublisher:
+    """Publisher stand-in whose futures resolve after a simulated round trip."""
+
+    def __init__(self, latency=0.002, workers=32):
+        self.latency = latency
+        self.pool = futures.ThreadPoolExecutor(max_workers=workers)
+
+    def topic_path(self, project_id, topic_id):
+        return f"projects/{project_id}/topics/{topic_id}"
+
+    def publish(self, topic_path, data):
+        return self.pool.submit(time.sleep, self.latency)
+
+
+def run(label, func, vehicle_ids, messages_per_vehicle):
+    publisher.count = 0
+    start = time.perf_counter()
+    func(vehicle_ids)
+    elapsed = time.perf_counter() - start
+    total = len(vehicle_ids) * messages_per_vehicle
+    print(f"{label:<12} {publisher.count:>8,} msgs in {elapsed:7.2f} s  ({total / elapsed:,.0f} msgs/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the sequential and concurrent publishers.")
+    parser.add_argument("--vehicles", type=int, default=40)
+    parser.add_argument("--messages", type=int, default=200, help="Breadcrumbs returned per vehicle")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--http-delay", type=float, default=0.05)
+    parser.add_argument("--publish-latency", type=float, default=0.002)
+    args = parser.parse_args()
+
+    BreadcrumbStub.delay = args.http_delay
+    BreadcrumbStub.payload = json.dumps([
+        {"EVENT_NO_TRIP": 220000000 + i, "ACT_TIME": 20000 + i, "METERS": i * 10}
+        for i in range(args.messages)
+    ]).encode("utf-8")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BreadcrumbStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    publisher.api_url = f"http://127.0.0.1:{server.server_port}/api/getBreadCrumbs"
+
+    vehicle_ids = [str(3000 + i) for i in range(args.vehicles)]
+    fake = FakePublisher(latency=args.publish_latency)
+    run("sequential", lambda ids: publisher.retrieve_and_publish_data(ids, publisher=fake),
+        vehicle_ids, args.messages)
+    run("concurrent", lambda ids: publisher.retrieve_and_publish_concurrent(ids, workers=args.workers, publisher=fake),
+        vehicle_ids, args.messages)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
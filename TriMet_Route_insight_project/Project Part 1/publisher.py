@@ -1,6 +1,9 @@
+import argparse
 import csv
 import json
 import requests
+from concurrent import futures
+from requests.adapters import HTTPAdapter
 from google.cloud import pubsub_v1
 import os
 
@@ -9,6 +12,21 @@ path = '/home/sumanasn/.config/gcloud/application_default_credentials.json'
 os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = path
 count = 0  # Global count to track the number of messages published
 
+project_id = "dataengineeringproject-420806"
+topic_id = "my-vehicle"
+api_url = "https://busdata.cs.pdx.edu/api/getBreadCrumbs"
+
+# Batch publishes client-side and block, rather than buffer without limit,
+# once too many messages are waiting to be sent.
+batch_settings = pubsub_v1.types.BatchSettings(max_messages=1000, max_bytes=1024 * 1024, max_latency=0.05)
+publisher_options = pubsub_v1.types.PublisherOptions(
+    flow_control=pubsub_v1.types.PublishFlowControl(
+        message_limit=20000,
+        byte_limit=64 * 1024 * 1024,
+        limit_exceeded_behavior=pubsub_v1.types.LimitExceededBehavior.BLOCK,
+    )
+)
+
 def read_vehicle_ids_from_csv(csv_file):
     """Read vehicle IDs from a specific column in the CSV file."""
     vehicle_ids = []
@@ -23,16 +41,14 @@ def read_vehicle_ids_from_csv(csv_file):
         print(f"Error reading vehicle IDs from CSV: {e}")
     return vehicle_ids
 
-def retrieve_and_publish_data(vehicle_ids):
+def retrieve_and_publish_data(vehicle_ids, publisher=None):
     """Retrieve data from the API for the given vehicle IDs and publish to Pub/Sub."""
-    project_id = "dataengineeringproject-420806"
-    topic_id = "my-vehicle"
-    publisher = pubsub_v1.PublisherClient()
+    publisher = publisher or pubsub_v1.PublisherClient()
     topic_path = publisher.topic_path(project_id, topic_id)
     global count
     for vehicle_id in vehicle_ids:
         try:
-            url = f"https://busdata.cs.pdx.edu/api/getBreadCrumbs?vehicle_id={vehicle_id}"
+            url = f"{api_url}?vehicle_id={vehicle_id}"
             response = requests.get(url)
             if response.status_code == 200:
                 data = response.json()
@@ -47,11 +63,70 @@ def retrieve_and_publish_data(vehicle_ids):
         except Exception as e:
             print(f"Error retrieving or publishing data for vehicle ID {vehicle_id}: {e}")
 
+def fetch_breadcrumbs(session, vehicle_id):
+    """Fetch the breadcrumbs of one vehicle over a shared session."""
+    response = session.get(api_url, params={"vehicle_id": vehicle_id}, timeout=30)
+    if response.status_code != 200:
+        raise RuntimeError(f"status code {response.status_code}")
+    return response.json()
+
+def retrieve_and_publish_concurrent(vehicle_ids, workers=8, publisher=None, session=None):
+    """Fetch vehicles concurrently and publish their messages in client-side batches.
+
+    Returns a dict mapping each vehicle ID to its published and failed message
+    counts, plus the error if the fetch itself failed.
+    """
+    publisher = publisher or pubsub_v1.PublisherClient(batch_settings, publisher_options)
+    topic_path = publisher.topic_path(project_id, topic_id)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+    global count
+
+    report = {vehicle_id: {"published": 0, "failed": 0, "error": None} for vehicle_id in vehicle_ids}
+    pending = {}  # vehicle_id -> publish futures
+    with futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        fetches = {pool.submit(fetch_breadcrumbs, session, vehicle_id): vehicle_id for vehicle_id in vehicle_ids}
+        # Publish each vehicle as soon as its fetch lands, while the rest are still in flight
+        for fetch in futures.as_completed(fetches):
+            vehicle_id = fetches[fetch]
+            try:
+                data = fetch.result()
+            except Exception as e:
+                report[vehicle_id]["error"] = str(e)
+                print(f"Failed to retrieve data for vehicle ID {vehicle_id}: {e}")
+                continue
+            pending[vehicle_id] = [
+                publisher.publish(topic_path, data=json.dumps(message).encode('utf-8'))
+                for message in data
+            ]
+
+    # Wait on every publish at once instead of one round trip per message
+    futures.wait([f for vehicle_futures in pending.values() for f in vehicle_futures])
+    for vehicle_id, vehicle_futures in pending.items():
+        failed = sum(1 for f in vehicle_futures if f.exception() is not None)
+        report[vehicle_id]["published"] = len(vehicle_futures) - failed
+        report[vehicle_id]["failed"] = failed
+        count += len(vehicle_futures) - failed
+        print(f"Published {len(vehicle_futures) - failed} messages for vehicle ID {vehicle_id} "
+              f"to {topic_path} ({failed} failed).")
+    return report
+
 def main():
-    csv_file = "vehicle_ids.csv"  # Path to the CSV file
-    vehicle_ids = read_vehicle_ids_from_csv(csv_file)
+    parser = argparse.ArgumentParser(description="Publish TriMet breadcrumbs to Pub/Sub.")
+    parser.add_argument("--csv", default="vehicle_ids.csv", help="CSV file with a Whimsy column of vehicle IDs")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Fetch vehicles concurrently with this many workers (0 keeps the sequential loop)")
+    args = parser.parse_args()
+
+    vehicle_ids = read_vehicle_ids_from_csv(args.csv)
     try:
-        retrieve_and_publish_data(vehicle_ids)
+        if args.workers > 0:
+            retrieve_and_publish_concurrent(vehicle_ids, workers=args.workers)
+        else:
+            retrieve_and_publish_data(vehicle_ids)
     except Exception as e:
         print(f"An error occurred: {e}")
     finally:
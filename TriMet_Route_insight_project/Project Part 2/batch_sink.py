@@ -0,0 +1,185 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+
+import pandas as pd
+
+
+class MicroBatchSink:
+    """Buffer validated breadcrumb rows and flush them every N rows or T seconds.
+
+    Pub/Sub callbacks only append to a deque, which is thread-safe without a
+    lock, so callback threads never wait on each other. A single flusher thread
+    drains the deque into a DataFrame and hands it to ``flush_func``. Messages
+    are acked only when ``flush_func`` reports that the batch was committed and
+    nacked otherwise, so Pub/Sub redelivers anything that did not reach the
+    database.
+
+    With a token_column, every row carries a token in that column and
+    ``flush_func`` may return the tokens of the rows it committed instead of
+    True. The other messages stay unsettled, which lets ``flush_func`` hold
+    rows back (e.g. to reorder them) and commit them in a later batch. A
+    failed batch nacks every unsettled message, and messages still unsettled
+    at close are nacked so Pub/Sub redelivers them.
+
+    With max_attempts, a message that has been in that many failed batches is
+    handed to ``dead_letter`` and acked instead of nacked, so one row the
+    database keeps rejecting cannot redeliver every message batched with it
+    forever. Messages that failed alongside it are dead-lettered with it, so
+    ``dead_letter`` should keep them where they can be reloaded.
+    """
+
+    # Failure counts are kept for at most this many recently failed messages
+    max_tracked_failures = 100000
+
+    def __init__(self, columns, flush_func, max_rows=5000, max_seconds=10.0, token_column=None,
+                 max_attempts=None, dead_letter=None):
+        self.columns = columns
+        self.flush_func = flush_func
+        self.max_rows = max_rows
+        self.max_seconds = max_seconds
+        self.rows_flushed = 0
+        self.batches_flushed = 0
+        self.batches_failed = 0
+        self.dead_lettered = 0
+        self.token_column = token_column
+        self.max_attempts = max_attempts
+        self.dead_letter = dead_letter
+        self._failures = OrderedDict()  # message_id -> failed batches, most recent last
+        self._tokens = itertools.count()
+        self._unsettled = {}  # token -> message, only used with token_column
+        self._pending = deque()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="breadcrumb-flusher", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def add(self, row, message):
+        """Queue one validated row together with the message that carried it."""
+        if self._stopped.is_set():
+            # Shutting down: let Pub/Sub redeliver instead of stranding the row
+            message.nack()
+            return
+        values = tuple(row[col] for col in self.columns)
+        if self.token_column is not None:
+            values += (next(self._tokens),)
+        self._pending.append((values, message))
+        if len(self._pending) >= self.max_rows:
+            self._wakeup.set()
+
+    def pending(self):
+        return len(self._pending)
+
+    def unsettled(self):
+        return len(self._unsettled)
+
+    def close(self):
+        """Stop the flusher and write whatever is still buffered."""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        while self._pending:
+            self.flush()
+        if self.token_column is not None:
+            # One last pass lets flush_func write anything it can still release
+            self.flush()
+            if self._unsettled:
+                print(f"Nacking {len(self._unsettled)} held messages for redelivery")
+                self._settle(list(self._unsettled), lambda message: message.nack())
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(timeout=self.max_seconds)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                break
+            if not self._pending and self._unsettled:
+                self.flush()  # Nothing new, but held rows may be due by now
+            # Drain in max_rows slices so one slow batch doesn't grow the next.
+            while self._pending:
+                self.flush()
+                if len(self._pending) < self.max_rows:
+                    break
+
+    def flush(self):
+        """Write one batch of at most max_rows rows and settle its messages."""
+        items = []
+        while self._pending and len(items) < self.max_rows:
+            items.append(self._pending.popleft())
+        if not items and not self._unsettled:
+            return
+
+        values, messages = zip(*items) if items else ((), ())
+        columns = self.columns if self.token_column is None else list(self.columns) + [self.token_column]
+        batch = pd.DataFrame.from_records(list(values), columns=columns)
+        if self.token_column is not None:
+            self._unsettled.update(zip(batch[self.token_column].tolist(), messages))
+        start = time.perf_counter()
+        dead_lettered = self.dead_lettered
+        try:
+            result = self.flush_func(batch)
+        except Exception as e:
+            print(f"Error flushing batch of {len(batch)} rows: {e}")
+            result = False
+
+        committed = result is not False and result is not None
+        if self.token_column is None:
+            for message in messages:
+                if committed:
+                    self._ack(message)
+                else:
+                    self._fail(message)
+            settled = len(batch)
+        elif committed:
+            settled = self._settle(list(self._unsettled) if result is True else result, self._ack)
+        else:
+            settled = self._settle(list(self._unsettled), self._fail)
+
+        if committed:
+            self.rows_flushed += settled
+            self.batches_flushed += 1
+        else:
+            self.batches_failed += 1
+        held = f", {len(self._unsettled)} held" if self.token_column is not None else ""
+        if self.dead_lettered > dead_lettered:
+            held += f", {self.dead_lettered - dead_lettered} dead-lettered after {self.max_attempts} failures"
+        print(f"Flushed {len(batch)} rows in {time.perf_counter() - start:.2f}s "
+              f"({'committed' if committed else 'nacked'} {settled}, {len(self._pending)} pending{held})")
+
+    def _settle(self, tokens, settle):
+        """Call settle on the unsettled messages with these tokens. Returns how many were settled."""
+        settled = 0
+        for token in tokens:
+            message = self._unsettled.pop(token, None)
+            if message is None:
+                continue
+            settle(message)
+            settled += 1
+        return settled
+
+    def _ack(self, message):
+        if self._failures:
+            self._failures.pop(message.message_id, None)
+        message.ack()
+
+    def _fail(self, message):
+        """Nack a message of a failed batch, or dead-letter it once it reaches max_attempts."""
+        if self.max_attempts is None:
+            message.nack()
+            return
+        attempts = self._failures.pop(message.message_id, 0) + 1
+        if attempts < self.max_attempts:
+            self._failures[message.message_id] = attempts
+            if len(self._failures) > self.max_tracked_failures:
+                self._failures.popitem(last=False)
+            message.nack()
+            return
+        if self.dead_letter is not None:
+            self.dead_letter(message)
+        self.dead_lettered += 1
+        message.ack()
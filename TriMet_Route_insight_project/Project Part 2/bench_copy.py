@@ -0,0 +1,83 @@
+import argparse
+import time
+import tracemalloc
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+import psycopg2
+
+from binary_copy import BinaryCopyStream, copy_binary
+from loaders import breadcrumb_columns, copy_from_stringio
+
+
+def synthetic_rows(rows, seed=7):
+    """Breadcrumb rows with the columns the breadcrumb table expects."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'tstamp': pd.Timestamp('2024-05-12') + pd.to_timedelta(rng.integers(0, 86400, rows), unit='s'),
+        'latitude': rng.uniform(45.3, 45.7, rows),
+        'longitude': rng.uniform(-122.9, -122.4, rows),
+        'speed': rng.uniform(0, 25, rows),
+        'trip_id': rng.integers(220000000, 220005000, rows),
+    })[list(breadcrumb_columns)]
+
+
+def encode_text(df):
+    buffer = StringIO()
+    df.to_csv(buffer, header=False, index=False, sep='\t')
+    return len(buffer.getvalue())
+
+
+def encode_binary(df):
+    stream = BinaryCopyStream(df)
+    total = 0
+    while True:
+        data = stream.read(8192)
+        if not data:
+            return total
+        total += len(data)
+
+
+def measure(label, func, df):
+    start = time.perf_counter()
+    func(df)
+    elapsed = time.perf_counter() - start
+    # tracemalloc slows allocation-heavy code down, so peak memory gets its own run
+    tracemalloc.start()
+    func(df)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<14} {len(df) / elapsed:>12,.0f} rows/s  peak {peak / 2**20:8.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark text vs binary COPY of breadcrumbs.")
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--dsn', help="Also load into this database (breadcrumb_bench is created and dropped)")
+    args = parser.parse_args()
+
+    df = synthetic_rows(args.rows)
+    # Encoding alone shows the client-side cost without any database
+    measure("text encode", encode_text, df)
+    measure("binary encode", encode_binary, df)
+
+    if args.dsn:
+        conn = psycopg2.connect(args.dsn)
+        cursor = conn.cursor()
+        cursor.execute("CREATE TABLE breadcrumb_bench (tstamp timestamp, latitude float, "
+                       "longitude float, speed float, trip_id integer)")
+        conn.commit()
+        try:
+            for label, writer in (("text COPY", copy_from_stringio), ("binary COPY", copy_binary)):
+                measure(label, lambda frame: writer(conn, frame, 'breadcrumb_bench'), df)
+                conn.rollback()
+        finally:
+            conn.rollback()
+            cursor.execute("DROP TABLE breadcrumb_bench")
+            conn.commit()
+            conn.close()
+
+
+if __name__ == "__main__":
+    main()
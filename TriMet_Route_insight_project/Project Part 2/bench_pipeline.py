@@ -0,0 +1,305 @@
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext, redirect_stdout
+
+import numpy as np
+import psycopg2.extensions
+
+from checkpoint import Checkpoint, create_checkpoint_table
+from db_pool import ConnectionPool, session_options
+from loaders import load_batch
+from processjson import process_json_file
+from quality import quality_report
+from speed_engine import calculate_speed
+from stream_speed import StreamingSpeed
+from summaries import create_summary_tables, trip_state
+from synthetic_feed import write_feed
+
+# Column names after save_data's rename
+load_names = {
+    'TIMESTAMP': 'tstamp',
+    'GPS_LATITUDE': 'latitude',
+    'GPS_LONGITUDE': 'longitude',
+    'SPEED': 'speed',
+    'EVENT_NO_TRIP': 'trip_id',
+    'VEHICLE_ID': 'vehicle_id',
+}
+
+# Against a real database everything is loaded into this scratch schema, which is dropped afterwards
+bench_schema = 'bench_pipeline'
+bench_tables = f"""
+DROP SCHEMA IF EXISTS {bench_schema} CASCADE;
+CREATE SCHEMA {bench_schema};
+CREATE TABLE {bench_schema}.trip (trip_id integer PRIMARY KEY, route_id integer, vehicle_id integer,
+                                  service_key text, direction text);
+CREATE TABLE {bench_schema}.breadcrumb (tstamp timestamp, latitude float, longitude float, speed float,
+                                        trip_id integer REFERENCES {bench_schema}.trip);
+"""
+
+
+class FakeCursor:
+    """Accepts the loaders' statements and reads every COPY stream to the end."""
+
+    description = None
+
+    def execute(self, query, params=None):
+        pass
+
+    def fetchall(self):
+        return []
+
+    def copy_from(self, file, table, sep='\t', null='\\N', columns=None):
+        while file.read(1 << 16):
+            pass
+
+    def copy_expert(self, sql, file):
+        if 'FROM STDIN' in sql:
+            self.copy_from(file, None)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """In-process stand-in for a psycopg2 connection, so the loaders' client-side cost can be measured alone."""
+
+    closed = 0
+
+    def cursor(self):
+        return FakeCursor()
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def get_transaction_status(self):
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        pass
+
+
+class FakePool:
+    def connection(self, timeout=None):
+        return nullcontext(FakeConnection())
+
+    def close(self):
+        pass
+
+
+def current_rss():
+    """Resident set size of this process in bytes."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # No /proc (macOS): fall back to the lifetime peak, reported in kilobytes on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class PeakRss:
+    """Samples RSS on a background thread while a with block runs."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+def run_stage(results, name, rows, func, *args):
+    """Time func(*args), with its prints silenced, and append the stage's figures to results."""
+    with PeakRss() as rss, open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        start = time.perf_counter()
+        value = func(*args)
+        seconds = time.perf_counter() - start
+    results.append({'stage': name, 'rows': rows, 'seconds': seconds,
+                    'rows_per_s': rows / seconds if seconds else float('inf'), 'peak_rss_mib': rss.peak / 2**20})
+    return value
+
+
+def save_batches(pool, frame, batch_rows, lateness=30, ttl=900):
+    """Run frame through the subscriber's save path in batch_rows slices. Returns per-batch seconds.
+
+    Each slice goes through a StreamingSpeed with the subscriber's settings
+    and the rows it releases are loaded, committing or resetting the stream
+    as Subscriber.save_data does. The rows still held at the end are
+    released and loaded as one last batch.
+    """
+    with pool.connection() as conn:
+        checkpoint = Checkpoint(capacity=max(len(frame), 1000)).load(conn)
+    speed_stream = StreamingSpeed(lateness=lateness, ttl=ttl)
+
+    def save(released, start):
+        if released.empty:
+            speed_stream.commit()
+            return
+        batch = released.rename(columns=load_names)
+        quality_report(batch)
+        with pool.connection() as conn:
+            inserted = load_batch(conn, batch, checkpoint=checkpoint, summaries=True)
+        if inserted is None:
+            speed_stream.reset()
+            raise RuntimeError(f"micro-batch at row {start} failed to load")
+        speed_stream.commit()
+
+    latencies = []
+    for start in range(0, len(frame), batch_rows):
+        began = time.perf_counter()
+        save(speed_stream.push(frame.iloc[start:start + batch_rows]), start)
+        latencies.append(time.perf_counter() - began)
+    began = time.perf_counter()
+    save(speed_stream.flush(), len(frame))
+    latencies.append(time.perf_counter() - began)
+    return latencies
+
+
+def load_all(pool, df):
+    """Load a whole day in one transaction, the way processjson does."""
+    with pool.connection() as conn:
+        checkpoint = Checkpoint(capacity=max(len(df), 1000)).load(conn)
+        if load_batch(conn, df, checkpoint=checkpoint, summaries=True) is None:
+            raise RuntimeError("load failed")
+
+
+def reset_tables(pool):
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("TRUNCATE breadcrumb, trip, breadcrumb_key, trip_summary, vehicle_day_summary;")
+        conn.commit()
+        cursor.close()
+
+
+def run_size(rows, workdir, dsn=None, batch_rows=5000, batches=40):
+    """Run every stage once for a dump of rows breadcrumbs. Returns the list of stage results."""
+    stages = []
+    path = os.path.join(workdir, f'bench_{rows}.json')
+    if dsn:
+        pool = ConnectionPool(maxconn=1, dsn=dsn, options=f'{session_options} -c search_path={bench_schema}')
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(bench_tables)
+            cursor.close()
+            conn.commit()
+    else:
+        pool = FakePool()
+    with pool.connection() as conn:
+        create_checkpoint_table(conn)
+        create_summary_tables(conn)
+
+    try:
+        records = run_stage(stages, 'generate', rows, write_feed, path, rows)
+        df = run_stage(stages, 'parse+validate', records, process_json_file, path)
+        os.remove(path)
+        stream = df.iloc[:batch_rows * batches].copy()
+
+        df = run_stage(stages, 'speed', len(df), calculate_speed, df)
+        df = df.rename(columns=load_names)
+        report = run_stage(stages, 'quality', len(df), quality_report, df)
+        df = df[~report['duplicate_rows']]
+        run_stage(stages, 'summaries', len(df), trip_state, df)
+
+        latencies = run_stage(stages, 'micro-batches', len(stream), save_batches, pool, stream, batch_rows)
+        p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+        stages[-1].update(batches=len(latencies), p50_ms=p50, p95_ms=p95, p99_ms=p99)
+
+        if dsn:
+            reset_tables(pool)
+        run_stage(stages, 'load', len(df), load_all, pool, df)
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+        if dsn:
+            with pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f"DROP SCHEMA IF EXISTS {bench_schema} CASCADE;")
+                cursor.close()
+                conn.commit()
+        pool.close()
+    return stages
+
+
+def print_results(rows, stages):
+    print(f"\n{rows:,} rows")
+    print(f"  {'stage':<15} {'rows':>12} {'seconds':>9} {'rows/s':>12} {'peak RSS':>11}  latency")
+    for stage in stages:
+        latency = ''
+        if 'p50_ms' in stage:
+            latency = (f"{stage['batches']} batches p50 {stage['p50_ms']:.1f} ms "
+                       f"p95 {stage['p95_ms']:.1f} ms p99 {stage['p99_ms']:.1f} ms")
+        print(f"  {stage['stage']:<15} {stage['rows']:>12,} {stage['seconds']:>9.3f} {stage['rows_per_s']:>12,.0f} "
+              f"{stage['peak_rss_mib']:>7.0f} MiB  {latency}")
+
+
+def compare(results, baseline, tolerance):
+    """Print stages whose throughput fell more than tolerance below the baseline. Returns how many did."""
+    previous = {(r['size'], r['stage']): r for r in baseline}
+    regressions = 0
+    for result in results:
+        before = previous.get((result['size'], result['stage']))
+        if before is None:
+            continue
+        change = result['rows_per_s'] / before['rows_per_s'] - 1
+        if change < -tolerance:
+            regressions += 1
+            print(f"REGRESSION {result['size']:,} rows {result['stage']}: "
+                  f"{before['rows_per_s']:,.0f} -> {result['rows_per_s']:,.0f} rows/s ({change:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the breadcrumb pipeline on synthetic dumps.")
+    parser.add_argument('--sizes', type=float, nargs='+', default=[1e5, 1e6, 1e7], help="Rows per run")
+    parser.add_argument('--dsn', help="Load into this database (a bench_pipeline schema is created and dropped); "
+                                      "without it the loaders run against an in-process fake connection")
+    parser.add_argument('--batch-rows', type=int, default=5000, help="Rows per subscriber micro-batch")
+    parser.add_argument('--batches', type=int, default=40, help="Micro-batches timed per run")
+    parser.add_argument('--workdir', default=tempfile.gettempdir(), help="Where the synthetic dumps are written")
+    parser.add_argument('--output', help="Save the results as JSON")
+    parser.add_argument('--compare', help="Flag stages slower than the results in this JSON file")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="Allowed throughput drop before flagging")
+    args = parser.parse_args()
+
+    results = []
+    for size in [int(s) for s in args.sizes]:
+        # A fresh process per size, so peak RSS is not inflated by the previous run
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            stages = executor.submit(run_size, size, args.workdir, args.dsn, args.batch_rows, args.batches).result()
+        print_results(size, stages)
+        results.extend(dict(stage, size=size) for stage in stages)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            if compare(results, json.load(file), args.tolerance):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
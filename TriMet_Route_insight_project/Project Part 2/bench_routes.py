@@ -0,0 +1,79 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from route_match import RouteIndex, match_trips, meters_per_lat, meters_per_lon, origin_lat, origin_lon
+
+
+def synthetic_shapes(routes, vertices=80, step=250.0, seed=3):
+    """Random-walk route shapes in both directions, laid out like GTFS shapes.txt."""
+    rng = np.random.default_rng(seed)
+    frames = []
+    for route in range(routes):
+        heading = rng.uniform(0, 2 * np.pi) + np.cumsum(rng.normal(0, 0.25, vertices))
+        x = rng.uniform(-15000, 15000) + np.cumsum(step * np.cos(heading))
+        y = rng.uniform(-15000, 15000) + np.cumsum(step * np.sin(heading))
+        for direction, (xs, ys) in enumerate([(x, y), (x[::-1], y[::-1])]):
+            frames.append(pd.DataFrame({
+                'shape_id': f"{route}_{direction}",
+                'shape_pt_lat': origin_lat + ys / meters_per_lat,
+                'shape_pt_lon': origin_lon + xs / meters_per_lon,
+                'shape_pt_sequence': np.arange(vertices),
+                'route_id': 100 + route,
+                'direction_id': direction,
+            }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def synthetic_trips(shapes, points, points_per_trip=400, noise=8.0, seed=5):
+    """Breadcrumbs of trips driven along random shapes with GPS noise."""
+    rng = np.random.default_rng(seed)
+    groups = {shape_id: g for shape_id, g in shapes.groupby('shape_id')}
+    shape_ids = list(groups)
+    frames, truth = [], []
+    for trip in range(points // points_per_trip):
+        shape = groups[shape_ids[rng.integers(len(shape_ids))]]
+        x = (shape['shape_pt_lon'].to_numpy() - origin_lon) * meters_per_lon
+        y = (shape['shape_pt_lat'].to_numpy() - origin_lat) * meters_per_lat
+        along = np.concatenate([[0], np.cumsum(np.hypot(np.diff(x), np.diff(y)))])
+        s = np.linspace(0, along[-1], points_per_trip)
+        px = np.interp(s, along, x) + rng.normal(0, noise, points_per_trip)
+        py = np.interp(s, along, y) + rng.normal(0, noise, points_per_trip)
+        trip_id = 220000000 + trip
+        frames.append(pd.DataFrame({
+            'trip_id': trip_id,
+            'tstamp': pd.Timestamp('2024-05-12 06:00') + pd.to_timedelta(np.arange(points_per_trip) * 5, unit='s'),
+            'latitude': origin_lat + py / meters_per_lat,
+            'longitude': origin_lon + px / meters_per_lon,
+        }))
+        truth.append((trip_id, shape['route_id'].iat[0], 'Out' if shape['direction_id'].iat[0] == 0 else 'Back'))
+    return pd.concat(frames, ignore_index=True), pd.DataFrame(truth, columns=['trip_id', 'route_id', 'direction'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark route matching on synthetic routes.")
+    parser.add_argument('--routes', type=int, default=80)
+    parser.add_argument('--points', type=int, default=2_000_000)
+    args = parser.parse_args()
+
+    shapes = synthetic_shapes(args.routes)
+    breadcrumbs, truth = synthetic_trips(shapes, args.points)
+
+    start = time.perf_counter()
+    index = RouteIndex(shapes)
+    built = time.perf_counter() - start
+    start = time.perf_counter()
+    matched = match_trips(breadcrumbs, index)
+    elapsed = time.perf_counter() - start
+
+    check = truth.merge(matched, on='trip_id', how='left', suffixes=('', '_matched'))
+    correct = ((check['route_id'] == check['route_id_matched']) & (check['direction'] == check['direction_matched'])).mean()
+    print(f"index: {len(index.x):,} points from {index.n_shapes} shapes in {built:.2f} s")
+    print(f"match: {len(breadcrumbs):,} breadcrumbs / {len(truth):,} trips in {elapsed:.2f} s "
+          f"({len(breadcrumbs) / elapsed:,.0f} points/s), {correct:.1%} matched correctly")
+
+
+if __name__ == "__main__":
+    main()
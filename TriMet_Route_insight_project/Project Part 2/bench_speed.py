@@ -0,0 +1,79 @@
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from speed_engine import calculate_speed
+
+
+def convert_to_timestamp(row):
+    date_part = datetime.strptime(row['OPD_DATE'].split(':')[0], '%d%b%Y')
+    full_timestamp = date_part + timedelta(seconds=int(row['ACT_TIME']))
+    return full_timestamp
+
+
+def legacy_calculate_speed(data):
+    """The original row-wise implementation, kept here as the baseline."""
+    data['TIMESTAMP'] = data.apply(convert_to_timestamp, axis=1)
+    data.sort_values(by=['EVENT_NO_TRIP', 'TIMESTAMP', 'VEHICLE_ID'], inplace=True)
+    data['SPEED'] = data.groupby('EVENT_NO_TRIP')['METERS'].diff() / data.groupby('EVENT_NO_TRIP')['TIMESTAMP'].diff().dt.total_seconds()
+    data['SPEED'] = data['SPEED'].bfill()
+    data['SPEED'] = data['SPEED'].clip(lower=0)
+    return data
+
+
+def synthetic_breadcrumbs(rows, trips=5000, vehicles=500, seed=42):
+    """Build a shuffled breadcrumb frame shaped like a day of TriMet data."""
+    rng = np.random.default_rng(seed)
+    trip = rng.integers(0, trips, rows)
+    # Points of one trip are roughly 5 seconds apart and keep moving forward.
+    act_time = 14400 + trip * 10 + rng.integers(0, 72000, rows)
+    meters = act_time * 8 + rng.integers(-50, 50, rows)
+    dates = np.array(['12MAY2024:00:00:00', '13MAY2024:00:00:00'])
+    return pd.DataFrame({
+        'EVENT_NO_TRIP': 220000000 + trip,
+        'ACT_TIME': act_time,
+        'OPD_DATE': dates[trip % 2],
+        'VEHICLE_ID': 3000 + trip % vehicles,
+        'METERS': meters,
+        'GPS_LATITUDE': rng.uniform(45.3, 45.7, rows),
+        'GPS_LONGITUDE': rng.uniform(-122.9, -122.4, rows),
+    })
+
+
+def timed(func, data):
+    start = time.perf_counter()
+    result = func(data)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark calculate_speed implementations.")
+    parser.add_argument('--rows', type=int, default=2_000_000)
+    parser.add_argument('--legacy-rows', type=int, default=200_000,
+                        help="Rows for the row-wise baseline, which is too slow for the full size.")
+    args = parser.parse_args()
+
+    data = synthetic_breadcrumbs(args.rows)
+
+    # Both implementations must agree before their timings mean anything.
+    sample = data.head(args.legacy_rows)
+    legacy, legacy_seconds = timed(legacy_calculate_speed, sample.copy())
+    vectorized, vectorized_seconds = timed(calculate_speed, sample.copy())
+    np.testing.assert_allclose(legacy['SPEED'].to_numpy(dtype='float64'),
+                               vectorized['SPEED'].to_numpy(dtype='float64'))
+    print(f"{len(sample):>10,} rows  legacy     {legacy_seconds:8.3f} s  "
+          f"({len(sample) / legacy_seconds:,.0f} rows/s)")
+    print(f"{len(sample):>10,} rows  vectorized {vectorized_seconds:8.3f} s  "
+          f"({len(sample) / vectorized_seconds:,.0f} rows/s)  "
+          f"speedup x{legacy_seconds / vectorized_seconds:.1f}")
+
+    _, full_seconds = timed(calculate_speed, data.copy())
+    print(f"{len(data):>10,} rows  vectorized {full_seconds:8.3f} s  "
+          f"({len(data) / full_seconds:,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import numpy as np
+
+# PostgreSQL binary COPY framing: signature, flags, header extension length
+header = b'PGCOPY\n\xff\r\n\x00' + np.array([0, 0], dtype='>i4').tobytes()
+trailer = np.array([-1], dtype='>i2').tobytes()
+
+# Wire type of each breadcrumb column, matching the breadcrumb table
+breadcrumb_types = {
+    'tstamp': 'timestamp',
+    'latitude': 'float8',
+    'longitude': 'float8',
+    'speed': 'float8',
+    'trip_id': 'int4',
+}
+breadcrumb_columns = tuple(breadcrumb_types)
+
+wire_dtypes = {'timestamp': '>i8', 'float8': '>f8', 'float4': '>f4', 'int8': '>i8', 'int4': '>i4'}
+
+# Timestamps travel as microseconds since 2000-01-01
+pg_epoch_us = np.datetime64('2000-01-01T00:00:00', 'us').astype('int64')
+
+
+def wire_values(values, pg_type):
+    """Convert a column to its binary COPY representation plus a NULL mask."""
+    if pg_type == 'timestamp':
+        micros = np.asarray(values, dtype='datetime64[us]')
+        nulls = np.isnat(micros)
+        return micros.view('int64') - pg_epoch_us, nulls
+    if pg_type.startswith('float'):
+        floats = np.asarray(values, dtype='float64')
+        return floats, np.isnan(floats)
+    ints = np.asarray(values)
+    if ints.dtype.kind == 'f':
+        nulls = np.isnan(ints)
+        return np.where(nulls, 0, ints).astype('int64'), nulls
+    return ints.astype('int64'), np.zeros(len(ints), dtype=bool)
+
+
+def encode_chunk(columns, types):
+    """Encode one chunk of rows as binary COPY tuples.
+
+    Rows are grouped by which of their fields are NULL. Every group has a fixed
+    width, so it is laid out with one structured NumPy array instead of a
+    per-row loop. COPY does not care about row order.
+    """
+    encoded = [wire_values(values, pg_type) for values, pg_type in zip(columns, types)]
+    n_rows = len(encoded[0][0])
+    pattern = np.zeros(n_rows, dtype='int64')
+    for i, (_, nulls) in enumerate(encoded):
+        pattern |= nulls.astype('int64') << i
+
+    parts = []
+    for code in np.unique(pattern):
+        rows = pattern == code
+        fields = [('count', '>i2')]
+        for i, pg_type in enumerate(types):
+            fields.append((f'len{i}', '>i4'))
+            if not (code >> i) & 1:
+                fields.append((f'val{i}', wire_dtypes[pg_type]))
+        block = np.empty(int(rows.sum()), dtype=fields)
+        block['count'] = len(types)
+        for i, (pg_type, (values, _)) in enumerate(zip(types, encoded)):
+            if (code >> i) & 1:
+                block[f'len{i}'] = -1
+            else:
+                block[f'len{i}'] = np.dtype(wire_dtypes[pg_type]).itemsize
+                block[f'val{i}'] = values[rows]
+        parts.append(block.tobytes())
+    return b''.join(parts)
+
+
+class BinaryCopyStream:
+    """File-like reader that encodes a DataFrame into binary COPY chunk by chunk.
+
+    Only one chunk of encoded rows is held at a time, so memory stays flat no
+    matter how large the batch is.
+    """
+
+    def __init__(self, df, columns=breadcrumb_columns, types=None, chunk_rows=65536):
+        types = types or breadcrumb_types
+        self.columns = [df[col].to_numpy() for col in columns]
+        self.types = [types[col] for col in columns]
+        self.n_rows = len(df)
+        self.chunk_rows = chunk_rows
+        self._next_row = 0
+        self._buffer = memoryview(header)
+        self._done = False
+
+    def _refill(self):
+        if self._next_row < self.n_rows:
+            stop = min(self._next_row + self.chunk_rows, self.n_rows)
+            chunk = [values[self._next_row:stop] for values in self.columns]
+            self._next_row = stop
+            return encode_chunk(chunk, self.types)
+        self._done = True
+        return trailer
+
+    def read(self, size=-1):
+        while not self._done and (size < 0 or len(self._buffer) < size):
+            self._buffer = memoryview(bytes(self._buffer) + self._refill())
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size].tobytes(), self._buffer[size:]
+        return data
+
+
+def copy_binary(conn, df, table, columns=breadcrumb_columns, types=None, chunk_rows=65536):
+    """COPY rows into table using the binary protocol. Does not commit."""
+    if 'trip_id' not in df.columns:
+        raise ValueError("Attempting to insert data but trip_id is missing")
+    stream = BinaryCopyStream(df, columns, types, chunk_rows)
+    cursor = conn.cursor()
+    try:
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH BINARY", stream)
+    finally:
+        cursor.close()
@@ -0,0 +1,149 @@
+import math
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+
+# Breadcrumb timestamps are keyed as seconds since 2000-01-01
+key_epoch = np.datetime64('2000-01-01T00:00:00', 's').astype('int64')
+
+
+def breadcrumb_keys(df):
+    """Pack (tstamp, trip_id) into one int64: seconds since 2000 << 32 | trip_id.
+
+    Putting time in the high bits keeps keys ordered by time, so the keys of
+    the last few days are a single range scan.
+    """
+    seconds = df['tstamp'].to_numpy(dtype='datetime64[s]').astype('int64') - key_epoch
+    trip_ids = pd.to_numeric(df['trip_id']).to_numpy(dtype='int64')
+    return (seconds << 32) | (trip_ids & 0xFFFFFFFF)
+
+
+def time_key(timestamp):
+    """Smallest key at or after timestamp."""
+    seconds = np.datetime64(pd.Timestamp(timestamp).to_datetime64(), 's').astype('int64') - key_epoch
+    return int(seconds) << 32
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over int64 keys, queried a whole array at a time."""
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+
+    def _positions(self, keys):
+        # Double hashing: position_i = h1 + i * h2, from two multiplicative hashes
+        keys = np.asarray(keys, dtype=np.int64).view(np.uint64)
+        with np.errstate(over='ignore'):
+            h1 = keys * np.uint64(0x9E3779B97F4A7C15)
+            h2 = (keys * np.uint64(0xC2B2AE3D27D4EB4F)) | np.uint64(1)
+            steps = np.arange(self.hashes, dtype=np.uint64)
+            positions = (h1[:, None] + steps[None, :] * h2[:, None]) % np.uint64(self.size)
+        return positions.astype(np.int64)
+
+    def add(self, keys):
+        positions = self._positions(keys).ravel()
+        np.bitwise_or.at(self.bits, positions >> 3, (1 << (positions & 7)).astype(np.uint8))
+
+    def might_contain(self, keys):
+        positions = self._positions(keys)
+        return ((self.bits[positions >> 3] >> (positions & 7)) & 1).all(axis=1).astype(bool)
+
+
+def create_checkpoint_table(conn):
+    """Create the breadcrumb_key table if needed, and commit."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("CREATE TABLE IF NOT EXISTS breadcrumb_key (key bigint PRIMARY KEY);")
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def copy_keys(cursor, table, keys):
+    buffer = StringIO('\n'.join(map(str, keys.tolist())) + '\n')
+    cursor.copy_from(buffer, table, columns=('key',))
+
+
+class Checkpoint:
+    """Remembers which breadcrumbs are already in the database.
+
+    Committed keys live in the breadcrumb_key table, created by
+    create_checkpoint_table, and are written in the same transaction as the
+    breadcrumbs, so a batch and its checkpoint commit or roll back together.
+    A Bloom filter loaded with the recent keys answers most lookups in
+    memory. Its positives, and rows older than what it was loaded with, are
+    confirmed with one join per batch.
+    """
+
+    def __init__(self, capacity=10_000_000, error_rate=0.01, horizon_days=2):
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.horizon_days = horizon_days
+        self.horizon = 0
+        self.skipped = 0
+
+    def load(self, conn):
+        """Fill the filter with the recent keys of the breadcrumb_key table."""
+        cursor = conn.cursor()
+        try:
+            self.horizon = time_key(pd.Timestamp.now().normalize() - pd.Timedelta(days=self.horizon_days))
+            buffer = StringIO()
+            cursor.copy_expert(f"COPY (SELECT key FROM breadcrumb_key WHERE key >= {self.horizon}) TO STDOUT", buffer)
+            conn.commit()
+        finally:
+            cursor.close()
+        keys = np.array(buffer.getvalue().split(), dtype=np.int64)
+        if len(keys):
+            self.bloom.add(keys)
+        print(f"Checkpoint loaded {len(keys)} keys")
+        return self
+
+    def filter_new(self, conn, df):
+        """Return (rows of df not yet committed, their keys)."""
+        keys = breadcrumb_keys(df)
+        # Keys older than the horizon were never loaded into the filter, so
+        # its negatives say nothing about them (a backfill of older days)
+        suspect = self.bloom.might_contain(keys) | (keys < self.horizon)
+        committed = np.zeros(len(keys), dtype=bool)
+        if suspect.any():
+            committed = np.isin(keys, self._find_committed(conn, keys[suspect]))
+        # Duplicates inside the batch would also collide on the key table
+        fresh = ~committed & ~pd.Series(keys).duplicated().to_numpy()
+        self.skipped += int((~fresh).sum())
+        return df[fresh], keys[fresh]
+
+    def _find_committed(self, conn, keys):
+        """Those of keys already in breadcrumb_key.
+
+        The keys are COPYed into a temp table and joined against the key
+        table. Bounding the join by the keys' range lets it read just that
+        slice of the primary key index, however many keys a backfill batch holds.
+        """
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS breadcrumb_key_probe
+                (key bigint) ON COMMIT DELETE ROWS;
+            """)
+            copy_keys(cursor, 'breadcrumb_key_probe', keys)
+            cursor.execute("""
+                SELECT k.key FROM breadcrumb_key k JOIN breadcrumb_key_probe p USING (key)
+                WHERE k.key BETWEEN %s AND %s;
+            """, (int(keys.min()), int(keys.max())))
+            return np.array([row[0] for row in cursor.fetchall()], dtype=np.int64)
+        finally:
+            cursor.close()
+
+    def record(self, conn, keys):
+        """Insert keys in the caller's transaction. Does not commit."""
+        cursor = conn.cursor()
+        try:
+            copy_keys(cursor, 'breadcrumb_key', keys)
+        finally:
+            cursor.close()
+
+    def committed(self, keys):
+        """Add keys to the filter once their transaction has committed."""
+        self.bloom.add(keys)
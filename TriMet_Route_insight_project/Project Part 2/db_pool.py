@@ -0,0 +1,195 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+
+# Connection string for the breadcrumb database. The password is read by libpq
+# from PGPASSWORD or ~/.pgpass, so it never has to live in the code.
+dsn = os.environ.get('TRIMET_DSN', 'dbname=whimsy_data user=postgres host=localhost')
+
+# Session settings sent with the startup packet, so they cost no extra round trip
+session_options = '-c work_mem=64MB'
+
+# For loads whose source can simply be replayed, like processjson's files:
+# commits return without waiting for the WAL flush, and a database crash can
+# lose the last few of them. Not for the subscriber, whose messages are acked
+# once committed and are never delivered again.
+bulk_load_options = session_options + ' -c synchronous_commit=off'
+
+# Idle connections older than this are pinged before being handed out
+check_after = 30.0
+
+
+def connect(dsn=dsn, options=session_options, retries=5, backoff=0.5, max_backoff=8.0):
+    """Open a connection, retrying with exponential backoff and jitter."""
+    for attempt in range(retries + 1):
+        try:
+            return psycopg2.connect(dsn, options=options)
+        except psycopg2.OperationalError as e:
+            if attempt == retries:
+                raise
+            delay = min(max_backoff, backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+            print(f"Failed to connect to database ({e.__class__.__name__}), retrying in {delay:.1f} s")
+            time.sleep(delay)
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of psycopg2 connections.
+
+    Connections are opened lazily up to maxconn. When all of them are in use,
+    acquire blocks until one comes back (or timeout passes). Connections that
+    sat idle for a while are pinged on checkout, and broken ones are replaced.
+    """
+
+    def __init__(self, maxconn=4, dsn=dsn, options=session_options, retries=5, timeout=30.0):
+        self.maxconn = maxconn
+        self.dsn = dsn
+        self.options = options
+        self.retries = retries
+        self.timeout = timeout
+        self._idle = deque()  # (connection, time returned)
+        self._opened = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        # Metrics, read with stats()
+        self.created = time.monotonic()
+        self._checked_out = {}  # id(connection) -> checkout time
+        self.busy_seconds = 0.0
+        self.acquired = 0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.connects = 0
+        self.discarded = 0
+
+    def acquire(self, timeout=None):
+        """Check out a healthy connection, waiting up to timeout seconds for one."""
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise psycopg2.InterfaceError("connection pool is closed")
+                if self._idle:
+                    conn, returned = self._idle.pop()
+                    break
+                if self._opened < self.maxconn:
+                    conn, returned = None, None
+                    self._opened += 1
+                    break
+                remaining = timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    raise psycopg2.OperationalError(f"no connection available after {timeout:g} s")
+                self._cond.wait(remaining)
+
+        try:
+            if conn is not None and not self._healthy(conn, returned):
+                self._discard(conn)
+                conn = None
+            if conn is None:
+                conn = connect(self.dsn, self.options, self.retries)
+                with self._cond:
+                    self.connects += 1
+        except Exception:
+            with self._cond:
+                self._opened -= 1
+                self._cond.notify()
+            raise
+
+        now = time.monotonic()
+        waited = now - start
+        with self._cond:
+            self._checked_out[id(conn)] = now
+            self.acquired += 1
+            self.wait_seconds += waited
+            self.max_wait = max(self.max_wait, waited)
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+        return conn
+
+    def release(self, conn):
+        """Return a connection. Open transactions are rolled back; dead connections are dropped."""
+        if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                pass
+        with self._cond:
+            self.in_use -= 1
+            self.busy_seconds += time.monotonic() - self._checked_out.pop(id(conn))
+            if conn.closed or self._closed:
+                self._opened -= 1
+                self.discarded += 1
+                if not conn.closed:
+                    conn.close()
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Borrow a connection for the duration of a with block."""
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def _healthy(self, conn, returned):
+        if conn.closed:
+            return False
+        if time.monotonic() - returned < check_after:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1;")
+            cursor.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        with self._cond:
+            self.discarded += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def stats(self):
+        """Checkout count, wait times and utilization since the pool was created.
+
+        utilization is the share of maxconn connection-seconds spent checked out.
+        """
+        with self._cond:
+            now = time.monotonic()
+            busy = self.busy_seconds + sum(now - t for t in self._checked_out.values())
+            return {
+                'acquired': self.acquired,
+                'mean_wait': self.wait_seconds / self.acquired if self.acquired else 0.0,
+                'max_wait': self.max_wait,
+                'in_use': self.in_use,
+                'open': self._opened,
+                'peak_in_use': self.peak_in_use,
+                'utilization': busy / (self.maxconn * (now - self.created)),
+                'connects': self.connects,
+                'discarded': self.discarded,
+            }
+
+    def close(self):
+        """Close idle connections now; checked-out ones are closed when released."""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._opened -= 1
+                conn.close()
+            self._cond.notify_all()
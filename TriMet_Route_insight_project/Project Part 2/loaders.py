@@ -0,0 +1,122 @@
+from io import StringIO
+
+import pandas as pd
+
+from binary_copy import copy_binary
+from summaries import upsert_summaries
+
+# Mapping day of the week to service key
+day_names = {0: 'Weekday', 1: 'Weekday', 2: 'Weekday', 3: 'Weekday', 4: 'Weekday', 5: 'Saturday', 6: 'Sunday'}
+
+breadcrumb_columns = ('tstamp', 'latitude', 'longitude', 'speed', 'trip_id')
+trip_columns = ('trip_id', 'route_id', 'vehicle_id', 'service_key', 'direction')
+
+
+def build_trip_frame(df, routes=None):
+    """One row per trip, with the service key derived from its service date.
+
+    routes, if given, holds trip_id, route_id and direction for matched trips;
+    the rest keep the default route 0 going 'Out'.
+    """
+    if 'service_date' in df.columns:  # Staged Parquet data stores the parsed date
+        df_trip = df[['trip_id', 'vehicle_id', 'service_date']].drop_duplicates(subset=['trip_id'])
+        opd_date = pd.to_datetime(df_trip['service_date'], format='%Y-%m-%d')
+    else:
+        df_trip = df[['trip_id', 'vehicle_id', 'OPD_DATE']].drop_duplicates(subset=['trip_id'])
+        opd_date = pd.to_datetime(df_trip['OPD_DATE'].str.split(':').str[0], format='%d%b%Y')
+    df_trip = df_trip.assign(service_key=opd_date.dt.dayofweek.map(day_names))
+    df_trip['route_id'] = 0  # Default value
+    df_trip['direction'] = 'Out'  # Default value
+    if routes is not None and not routes.empty:
+        matched = df_trip[['trip_id']].merge(routes, on='trip_id', how='left')
+        has_route = matched['route_id'].notna().to_numpy()
+        df_trip.loc[has_route, 'route_id'] = matched.loc[has_route, 'route_id'].astype('int64').to_numpy()
+        df_trip.loc[has_route, 'direction'] = matched.loc[has_route, 'direction'].to_numpy()
+    return df_trip[list(trip_columns)]
+
+
+def copy_frame(cursor, df, table, columns):
+    """COPY a DataFrame into table as tab-separated text. Does not commit."""
+    buffer = StringIO()
+    # NaN (e.g. the speed of a trip's only point in a batch) must reach COPY as NULL, not ''
+    df.to_csv(buffer, header=False, index=False, sep='\t', na_rep='\\N')
+    buffer.seek(0)
+    try:
+        cursor.copy_from(buffer, table, sep='\t', columns=columns)
+    finally:
+        buffer.close()
+
+
+def insert_trip_data(df, conn, routes=None):
+    """Upsert the batch's trips through a staging table. Does not commit.
+
+    The trips are COPYed into a session temp table and moved into Trip with a
+    single INSERT ... SELECT, so the cost is two statements per batch however
+    many trips it holds. A trip stored with the default route picks up its
+    route and direction once a later batch matches it.
+    """
+    df_trip = build_trip_frame(df, routes)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS trip_stage
+            (LIKE Trip INCLUDING DEFAULTS) ON COMMIT DELETE ROWS;
+        """)
+        copy_frame(cursor, df_trip, 'trip_stage', trip_columns)
+        cursor.execute("""
+            INSERT INTO Trip (trip_id, route_id, vehicle_id, service_key, direction)
+            SELECT trip_id, route_id, vehicle_id, service_key, direction FROM trip_stage
+            ON CONFLICT (trip_id) DO UPDATE
+                SET route_id = EXCLUDED.route_id, direction = EXCLUDED.direction
+                WHERE Trip.route_id = 0 AND EXCLUDED.route_id <> 0;
+        """)
+    finally:
+        cursor.close()
+
+
+def copy_from_stringio(conn, df, table):
+    """COPY breadcrumb rows into table. Does not commit."""
+    if 'trip_id' not in df.columns:
+        raise ValueError("Attempting to insert data but trip_id is missing")
+    cursor = conn.cursor()
+    try:
+        copy_frame(cursor, df, table, breadcrumb_columns)
+    finally:
+        cursor.close()
+
+
+def load_batch(conn, df, binary=False, routes=None, checkpoint=None, summaries=False):
+    """Write trips and breadcrumbs in one transaction.
+
+    Returns the number of breadcrumbs inserted, or None if the transaction was
+    rolled back.
+
+    With binary=True breadcrumbs are streamed with binary COPY instead of text.
+    routes is passed on to insert_trip_data. With a checkpoint, breadcrumbs
+    that were already committed are skipped and the new ones are recorded in
+    the same transaction. With summaries=True the new breadcrumbs are also
+    folded into trip_summary and vehicle_day_summary.
+    """
+    try:
+        if checkpoint is not None:
+            df, keys = checkpoint.filter_new(conn, df)
+            if df.empty:
+                print("All breadcrumbs in this batch were already loaded.")
+                return 0
+        insert_trip_data(df, conn, routes)
+        if binary:
+            copy_binary(conn, df, 'breadcrumb')
+        else:
+            copy_from_stringio(conn, df[list(breadcrumb_columns)], 'breadcrumb')
+        if summaries:
+            upsert_summaries(conn, df)
+        if checkpoint is not None:
+            checkpoint.record(conn, keys)
+        conn.commit()
+        if checkpoint is not None:
+            checkpoint.committed(keys)
+        return len(df)
+    except Exception as error:
+        print(f"Error: {error}")
+        conn.rollback()
+        return None
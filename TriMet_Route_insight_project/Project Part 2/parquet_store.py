@@ -0,0 +1,98 @@
+import argparse
+import os
+from collections import Counter
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from speed_engine import build_timestamps
+
+# Default location of the staged breadcrumbs
+staging_root = 'staged_breadcrumbs'
+
+# Columns stored in each Parquet file; service_date and VEHICLE_ID live in the
+# directory names (service_date=2024-05-12/VEHICLE_ID=3010/...)
+breadcrumb_schema = pa.schema([
+    ('EVENT_NO_TRIP', pa.int64()),
+    ('ACT_TIME', pa.int32()),
+    ('TIMESTAMP', pa.timestamp('us')),
+    ('METERS', pa.float64()),
+    ('GPS_LATITUDE', pa.float32()),
+    ('GPS_LONGITUDE', pa.float32()),
+    ('GPS_SATELLITES', pa.float32()),
+    ('GPS_HDOP', pa.float32()),
+])
+partition_schema = pa.schema([('service_date', pa.string()), ('VEHICLE_ID', pa.int32())])
+
+# What calculate_speed and the loaders need, and nothing else
+load_columns = ['EVENT_NO_TRIP', 'VEHICLE_ID', 'service_date', 'TIMESTAMP', 'METERS', 'GPS_LATITUDE', 'GPS_LONGITUDE']
+
+
+def to_staging_table(df):
+    """Cast a validated breadcrumb frame to the staging schema."""
+    staged = pd.DataFrame({
+        'service_date': pd.to_datetime(df['OPD_DATE'].str.split(':').str[0], format='%d%b%Y').dt.strftime('%Y-%m-%d'),
+        'VEHICLE_ID': pd.to_numeric(df['VEHICLE_ID']).astype('int32'),
+        'EVENT_NO_TRIP': pd.to_numeric(df['EVENT_NO_TRIP']).astype('int64'),
+        'ACT_TIME': pd.to_numeric(df['ACT_TIME']).astype('int32'),
+        'TIMESTAMP': build_timestamps(df['OPD_DATE'], df['ACT_TIME']),
+    })
+    for col in ('METERS', 'GPS_LATITUDE', 'GPS_LONGITUDE', 'GPS_SATELLITES', 'GPS_HDOP'):
+        staged[col] = pd.to_numeric(df[col], errors='coerce')
+    return pa.Table.from_pandas(staged, schema=pa.unify_schemas([partition_schema, breadcrumb_schema]),
+                                preserve_index=False)
+
+
+def write_breadcrumbs(df, root=staging_root, source='breadcrumbs'):
+    """Write validated breadcrumbs under root, partitioned by service date and vehicle.
+
+    File names start with source (the dump they came from), so re-staging a dump
+    overwrites its own files while other dumps for the same service date stay.
+    """
+    if df.empty:
+        return 0
+    ds.write_dataset(
+        to_staging_table(df), root, format='parquet',
+        partitioning=ds.partitioning(partition_schema, flavor='hive'),
+        basename_template=source + '-{i}.parquet',
+        existing_data_behavior='overwrite_or_ignore',
+    )
+    return len(df)
+
+
+def read_breadcrumbs(root=staging_root, columns=load_columns, dates=None, vehicles=None):
+    """Read staged breadcrumbs, touching only the requested columns and partitions.
+
+    dates are 'YYYY-MM-DD' strings and vehicles are vehicle ids; either filter
+    prunes whole directories before any file is opened.
+    """
+    dataset = ds.dataset(root, format='parquet', partitioning=ds.partitioning(partition_schema, flavor='hive'))
+    condition = None
+    if dates is not None:
+        condition = ds.field('service_date').isin(list(dates))
+    if vehicles is not None:
+        vehicle_filter = ds.field('VEHICLE_ID').isin([int(v) for v in vehicles])
+        condition = vehicle_filter if condition is None else condition & vehicle_filter
+    return dataset.to_table(columns=columns, filter=condition).to_pandas()
+
+
+def main():
+    from processjson import expand_paths, process_json_file
+
+    parser = argparse.ArgumentParser(description="Stage validated TriMet breadcrumb dumps as partitioned Parquet.")
+    parser.add_argument('paths', nargs='+', help="JSON files, directories or glob patterns")
+    parser.add_argument('--root', default=staging_root, help="Root directory of the Parquet dataset")
+    args = parser.parse_args()
+
+    rejects = Counter()
+    for file_path in expand_paths(args.paths):
+        source = os.path.basename(file_path).split('.')[0]
+        staged = write_breadcrumbs(process_json_file(file_path, rejects=rejects), args.root, source)
+        print(f"{file_path}: {staged} rows staged")
+    for reason, rejected in rejects.most_common():
+        print(f"  rejected {reason}: {rejected}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,25 @@
 import os
+import sys
+import glob
+import gzip
 import json
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 import pandas as pd
-import psycopg2
-from datetime import datetime, timedelta
-from scipy.stats import zscore
-from io import StringIO
+from speed_engine import calculate_speed
+from loaders import load_batch
+from quality import quality_report
+from route_match import gtfs_path, load_route_index, match_trips
+from checkpoint import Checkpoint, create_checkpoint_table
+from summaries import create_summary_tables
+from db_pool import ConnectionPool, bulk_load_options, connect
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
 
 # Directory where JSON files are stored
 directory_path = 'received_data/20240512.json'
@@ -12,122 +27,90 @@ directory_path = 'received_data/20240512.json'
 # Columns expected in the JSON data
 columns = ['EVENT_NO_TRIP', 'ACT_TIME', 'OPD_DATE', 'VEHICLE_ID', 'METERS', 'GPS_LATITUDE', 'GPS_LONGITUDE', 'GPS_SATELLITES', 'GPS_HDOP']
 
-def convert_to_timestamp(row):
-    date_part = datetime.strptime(row['OPD_DATE'].split(':')[0], '%d%b%Y')
-    full_timestamp = date_part + timedelta(seconds=int(row['ACT_TIME']))
-    return full_timestamp
-
-def calculate_speed(data):
-    data['TIMESTAMP'] = data.apply(convert_to_timestamp, axis=1)
-    data.sort_values(by=['EVENT_NO_TRIP', 'TIMESTAMP', 'VEHICLE_ID'], inplace=True)
-    data['SPEED'] = data.groupby('EVENT_NO_TRIP')['METERS'].diff() / data.groupby('EVENT_NO_TRIP')['TIMESTAMP'].diff().dt.total_seconds()
-    data['SPEED'] = data['SPEED'].fillna(method='bfill')
-    data['SPEED'] = data['SPEED'].clip(lower=0)
-    return data
-
-# Function to process each JSON file
-def process_json_file(file_path):
-    """Process a JSON file that may contain multiple JSON objects per line."""
-    data_rows = []  # List to store valid rows
-    with open(file_path, 'r') as file:
-        for line_number, line in enumerate(file, 1):
+# Lines parsed and validated together in one DataFrame
+chunk_size = 100000
+
+
+def iter_json_lines(lines, chunk_size=chunk_size, rejects=None):
+    """Yield validated DataFrames of at most chunk_size lines from an iterable of JSON lines.
+
+    Rejected lines are tallied by reason in the rejects Counter instead of printed.
+    """
+    rejects = rejects if rejects is not None else Counter()
+    lines = iter(lines)
+    while True:
+        batch = list(islice(lines, chunk_size))
+        if not batch:
+            break
+        items = []
+        for line in batch:
             try:
-                item = json.loads(line.strip())
-                new_row = {col: item.get(col, None) for col in columns}
-
-                # Validate latitude and longitude
-                lat = new_row['GPS_LATITUDE']
-                lon = new_row['GPS_LONGITUDE']
-                if lat is None or lon is None:
-                    raise ValueError(f"Line {line_number}: Latitude or longitude cannot be None.")
-                lat, lon = float(lat), float(lon)
-                if not (45.0 <= lat <= 46.0):
-                    raise ValueError(f"Line {line_number}: Latitude {lat} out of bounds.")
-                if not (-124.0 <= lon <= -122.0):
-                    raise ValueError(f"Line {line_number}: Longitude {lon} out of bounds.")
-
-                # Validate meters
-                meters = new_row['METERS']
-                if meters is not None and float(meters) < 0:
-                    raise ValueError(f"Line {line_number}: Negative meters value.")
-
-                # Ensure EVENT_NO_TRIP column exists
-                if 'EVENT_NO_TRIP' not in new_row or new_row['EVENT_NO_TRIP'] is None:
-                    raise ValueError(f"Line {line_number}: EVENT_NO_TRIP column is missing or None.")
-
-                data_rows.append(new_row)
-
-            except json.JSONDecodeError as e:
-                print(f"Error decoding JSON on line {line_number}: {e}")
-            except ValueError as e:
-                print(e)
+                item = json_loads(line)
+            except ValueError:
+                rejects['bad_json'] += 1
                 continue
+            if isinstance(item, dict):
+                items.append(item)
+            else:
+                rejects['bad_json'] += 1
+        chunk = pd.DataFrame.from_records(items, columns=columns)
+        yield validate_chunk(chunk, rejects)
+
+
+def iter_json_chunks(file_path, chunk_size=chunk_size, rejects=None):
+    """Yield validated DataFrames of at most chunk_size lines from a JSON-lines file."""
+    # Archives from the Part 1 subscriber are concatenated gzip members
+    opener = gzip.open if file_path.endswith('.gz') else open
+    with opener(file_path, 'rb') as file:
+        yield from iter_json_lines(file, chunk_size, rejects)
+
+
+def validate_chunk(chunk, rejects):
+    """Drop invalid rows column-wise, counting each row under its first failing check."""
+    lat = pd.to_numeric(chunk['GPS_LATITUDE'], errors='coerce')
+    lon = pd.to_numeric(chunk['GPS_LONGITUDE'], errors='coerce')
+    meters = pd.to_numeric(chunk['METERS'], errors='coerce')
+    checks = [
+        ('missing_position', lat.isna() | lon.isna()),
+        ('latitude_out_of_bounds', ~lat.between(45.0, 46.0)),
+        ('longitude_out_of_bounds', ~lon.between(-124.0, -122.0)),
+        ('negative_meters', meters < 0),
+        ('missing_trip', chunk['EVENT_NO_TRIP'].isna()),
+    ]
+    rejected = pd.Series(False, index=chunk.index)
+    for reason, failed in checks:
+        failed = failed & ~rejected
+        if failed.any():
+            rejects[reason] += int(failed.sum())
+            rejected |= failed
+    return chunk[~rejected]
+
+
+def concat_chunks(chunks):
+    chunks = list(chunks)
+    if not chunks:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def process_json_file(file_path, chunk_size=chunk_size, rejects=None):
+    """Process a JSON file that may contain multiple JSON objects per line."""
+    return concat_chunks(iter_json_chunks(file_path, chunk_size, rejects))
 
-    df_local = pd.DataFrame(data_rows)  # Convert collected rows to DataFrame at once
-    return df_local
 
-def get_db_connection():
-    try:
-        connection = psycopg2.connect(
-            dbname="whimsy_data",
-            user="postgres",
-            password="Maskdep",
-            host="localhost"
-        )
-        print("Database connection established")
-        return connection
-    except Exception as e:
-        print(f"Failed to connect to database: {e}")
+def process_json_lines(lines, chunk_size=chunk_size, rejects=None):
+    """Process JSON lines from any iterable, such as Part 1's archive.replay."""
+    return concat_chunks(iter_json_lines(lines, chunk_size, rejects))
 
+def save_data(df, conn=None, print_frames=False):
+    """Validate and load df, reusing conn if given.
 
-def copy_from_stringio(conn, df, table):
-    if 'trip_id' not in df.columns:
-        raise ValueError("Attempting to insert data but trip_id is missing")
-    buffer = StringIO()
-    df.to_csv(buffer, header=False, index=False, sep='\t')
-    buffer.seek(0)
-    cursor = conn.cursor()
-    try:
-        cursor.copy_from(buffer, table, sep='\t', columns=('tstamp', 'latitude', 'longitude', 'speed', 'trip_id'))
-        conn.commit()
-    except Exception as error:
-        print(f"Error: {error}")
-        conn.rollback()
-    finally:
-        cursor.close()
-        buffer.close()
-
-def insert_trip_data(df, conn):
-    # Convert OPD_DATE to datetime
-    df['NEW_OPD_DATE'] = pd.to_datetime(df['OPD_DATE'].str.split(':').str[0], format='%d%b%Y')
-    df['DAY_OF_WEEK'] = df['NEW_OPD_DATE'].dt.dayofweek
-
-    # Mapping day of the week to service key
-    day_names = {0: 'Weekday', 1: 'Weekday', 2: 'Weekday', 3: 'Weekday', 4: 'Weekday', 5: 'Saturday', 6: 'Sunday'}
-    df['DAY_NAME'] = df['DAY_OF_WEEK'].map(day_names)
-
-    # Prepare data for insertion using the new column names already assigned before calling this function
-    df_trip = df[['trip_id', 'vehicle_id', 'DAY_NAME']].drop_duplicates()
-    df_trip = df_trip.rename(columns={'DAY_NAME': 'service_key'})
-    df_trip['route_id'] = 0  # Default value
-    df_trip['direction'] = 'Out'  # Default value
-
-    # Database insertion
-    cursor = conn.cursor()
-    for _, row in df_trip.iterrows():
-        cursor.execute("""
-            INSERT INTO Trip (trip_id, route_id, vehicle_id, service_key, direction)
-            VALUES (%s, %s, %s, %s, %s) ON CONFLICT (trip_id) DO NOTHING;
-        """, (row['trip_id'], row['route_id'], row['vehicle_id'], row['service_key'], row['direction']))
-    conn.commit()
-    cursor.close()
-
-
-def save_data(df):
+    Returns the number of breadcrumbs inserted, or None if nothing was committed.
+    """
     print('transforming')
     if df.empty:
         print("No valid data to save for today.")
-        return
+        return 0
     # Calculate speed and assign it to the DataFrame
     df = calculate_speed(df)
 
@@ -143,65 +126,140 @@ def save_data(df):
 
     try:
 
-        # Check and print negative speeds
-        if (df['speed'] < 0).any():
-            print("Negative speed records:")
-            print(df[df['speed'] < 0])
-
-        # Calculate z-scores for speeds to detect outliers
-        df['z_scores'] = zscore(df['speed'])
-        if (df['z_scores'].abs() > 3).any():
-            print("Significant outliers in speeds:")
-            print(df[df['z_scores'].abs() > 3])
-        df.drop(columns='z_scores', inplace=True)  # Remove z_scores after checking
-
-        # Check for trips with average speeds exceeding 30 meters per second
-        high_speed_trips = df.groupby('trip_id')['speed'].mean() > 30
-        if high_speed_trips.any():
-            print("Trips with average speeds exceeding 30 meters per second:")
-            print(df[df['trip_id'].isin(high_speed_trips[high_speed_trips].index)])
-
-
-        # Verify chronological order of timestamps within each trip
-        if not df.groupby('trip_id').apply(lambda x: x['tstamp'].is_monotonic_increasing).all():
-            print("Non-chronological timestamp records:")
-            problematic_trips = df.groupby('trip_id').filter(lambda x: not x['tstamp'].is_monotonic_increasing)
-            print(problematic_trips)
-
-        # Check for duplicate timestamps within the same trip
-        if df.duplicated(subset=['tstamp', 'trip_id']).any():
-            print("Duplicate timestamp records:")
-            print(df[df.duplicated(subset=['tstamp', 'trip_id'],keep=False)])
-            df=df.drop_duplicates(subset=['tstamp','trip_id'],keep='first')
-
-        # Check median speed constraint
-        median_speed = df['speed'].median()
-        below_median = df[df['speed'] < median_speed]
-        if below_median.shape[0] <= df.shape[0] / 2:
-            print("More than 50% of breadcrumb records do not have speeds below the median speed:")
-            print(df[df['speed'] >= median_speed])
-
-        # Insert data into the database
-        conn = get_db_connection()
-        insert_trip_data(df,conn)
-        copy_from_stringio(conn, df[['tstamp', 'latitude', 'longitude', 'speed', 'trip_id']], 'breadcrumb')
+        # Run every data-quality assertion in one go; pass print_frames=True to dump offending rows
+        report = quality_report(df, print_frames=print_frames)
+        if report['checks']['duplicate_timestamps']['count']:
+            df = df[~report['duplicate_rows']]
+
+        # Match trips to routes when a GTFS feed is loaded
+        routes = match_trips(df, route_index) if route_index is not None else None
+        # Insert data into the database, borrowing a pooled connection if none was given
+        if conn is None:
+            with pool.connection() as conn:
+                inserted = load_batch(conn, df, routes=routes, checkpoint=checkpoint, summaries=True)
+        else:
+            inserted = load_batch(conn, df, routes=routes, checkpoint=checkpoint, summaries=True)
+        if inserted is not None:
+            print("Data processed successfully.")
+        return inserted
 
     except Exception as e:
         print(f"Error during processing: {e}")
+        return None
+
+
+# Each worker process loads one file at a time, so its pool holds a single
+# connection that is reused for every file it loads
+pool = None
+# Route shapes used to fill Trip.route_id and direction, if a GTFS feed is given
+route_index = None
+# Breadcrumbs already loaded, so re-running a day only inserts what is new
+checkpoint = None
+
+
+def create_tables():
+    """Create the checkpoint and summary tables once, before any worker starts loading.
+
+    Concurrent CREATE OR REPLACE FUNCTION and CREATE TABLE IF NOT EXISTS can
+    fail in Postgres ("tuple concurrently updated"), so workers run no DDL.
+    """
+    conn = connect()
+    try:
+        create_checkpoint_table(conn)
+        create_summary_tables(conn)
     finally:
-        if 'conn' in locals():
-            conn.close()
-        print("Data processed successfully.")
-        df = pd.DataFrame(columns=['tstamp', 'latitude', 'longitude', 'speed', 'trip_id'])  # Clear DataFrame for next batch
+        conn.close()
+
+
+def init_worker(gtfs_dir=None):
+    global pool, route_index, checkpoint
+    # Files are the source of truth here, so a lost commit is reloaded by running them again
+    pool = ConnectionPool(maxconn=1, options=bulk_load_options)
+    with pool.connection() as conn:
+        checkpoint = Checkpoint().load(conn)
+    if gtfs_dir:
+        route_index = load_route_index(gtfs_dir)
+
+
+def process_and_save(file_path, chunk_size=chunk_size):
+    """Load one daily dump. Returns (file_path, rows inserted or None if the load failed, rejected counts)."""
+    rejects = Counter()
+    if os.path.basename(file_path).startswith('service_date='):
+        # A day of staged Parquet: read just the columns the load needs
+        from parquet_store import read_breadcrumbs
+        root, partition = os.path.split(file_path)
+        df = read_breadcrumbs(root, dates=[partition.split('=', 1)[1]])
+    else:
+        df = process_json_file(file_path, chunk_size, rejects)
+    return file_path, save_data(df), rejects
+
+
+def expand_paths(paths):
+    """Expand paths into JSON files, gzip archives and staged Parquet day partitions."""
+    files = []
+    for path in paths:
+        if os.path.basename(os.path.normpath(path)).startswith('service_date='):
+            files.extend(glob.glob(os.path.normpath(path)))
+        elif os.path.isdir(path):
+            files.extend(glob.glob(os.path.join(path, '*.json')))
+            files.extend(glob.glob(os.path.join(path, '*.json.gz')))
+        else:
+            files.extend(glob.glob(path))
+    return sorted(set(files))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate and load TriMet breadcrumb dumps into PostgreSQL.")
+    parser.add_argument('paths', nargs='*', default=[directory_path],
+                        help="JSON files, directories, glob patterns or staged service_date=YYYY-MM-DD partitions, "
+                             "or - to read JSON lines from stdin (e.g. piped from Part 1's archive.py)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Files loaded in parallel")
+    parser.add_argument('--gtfs', default=gtfs_path, help="GTFS feed directory with shapes.txt and trips.txt")
+    parser.add_argument('--chunk-size', type=int, default=chunk_size, help="Lines parsed per chunk")
+    args = parser.parse_args()
+
+    if args.paths == ['-']:
+        # Piped JSON lines are read and loaded in this process
+        create_tables()
+        init_worker(args.gtfs)
+        rejects = Counter()
+        df = process_json_lines(sys.stdin.buffer, args.chunk_size, rejects)
+        print_results([('<stdin>', save_data(df), rejects)])
+        return
+
+    files = expand_paths(args.paths)
+    if not files:
+        print("No valid data to process.")
+        return
+
+    create_tables()
+    # Each worker process keeps its own connection, so files load in parallel
+    with ProcessPoolExecutor(max_workers=min(args.workers, len(files)), initializer=init_worker, initargs=(args.gtfs,)) as executor:
+        print_results(executor.map(process_and_save, files, [args.chunk_size] * len(files)))
+
+
+def print_results(results):
+    """Print each file's outcome as it arrives, then the totals."""
+    files = 0
+    total_loaded = 0
+    total_rejects = Counter()
+    for file_path, loaded, rejects in results:
+        files += 1
+        if loaded is None:
+            print(f"{file_path}: load failed, {sum(rejects.values())} rejected")
+        else:
+            print(f"{file_path}: {loaded} rows loaded, {sum(rejects.values())} rejected")
+            total_loaded += loaded
+        total_rejects.update(rejects)
+
+    print(f"Loaded {total_loaded} rows from {files} files.")
+    for reason, rejected in total_rejects.most_common():
+        print(f"  rejected {reason}: {rejected}")
 
 
 if __name__ == '__main__':
     try:
-        df = process_json_file(directory_path)
-        if not df.empty:
-            save_data(df)
-        else:
-            print("No valid data to process.")
+        main()
     except Exception as e:
         print("An error occurred during processing:")
         print(e)
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+
+# Trips whose average speed is above this many meters per second are flagged
+max_trip_mean_speed = 30
+# Speeds further than this many standard deviations from the mean are outliers
+zscore_limit = 3
+
+
+def quality_report(df, sample_rows=5, print_frames=False):
+    """Run every breadcrumb assertion over df in a couple of vectorized passes.
+
+    df must carry the database column names (tstamp, speed, trip_id). Returns a
+    dict with one entry per check holding the number of offending rows, the
+    offending trip ids and a few sample rows, plus a ``duplicate_rows`` mask
+    that marks every repeated (tstamp, trip_id) after its first occurrence.
+    """
+    n = len(df)
+    speed = df['speed'].to_numpy(dtype='float64')
+    tstamp = df['tstamp'].to_numpy(dtype='datetime64[ns]').view('int64')
+    trip_codes, trip_ids = pd.factorize(df['trip_id'])
+    n_trips = len(trip_ids)
+
+    # Pass 1: column-wide statistics and per-trip means via bincount
+    negative = speed < 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        zscores = (speed - speed.mean()) / speed.std()
+        outliers = np.abs(zscores) > zscore_limit
+        valid = ~np.isnan(speed) & (trip_codes >= 0)
+        sums = np.bincount(trip_codes[valid], weights=speed[valid], minlength=n_trips)
+        counts = np.bincount(trip_codes[valid], minlength=n_trips)
+        fast_trips = sums / counts > max_trip_mean_speed
+    median = np.nanmedian(speed) if n else np.nan
+    below_median = int((speed < median).sum())
+    median_violation = speed >= median if below_median <= n / 2 else np.zeros(n, dtype=bool)
+
+    # Pass 2: one stable sort by trip keeps each trip's rows in arrival order,
+    # which is what "chronological within a trip" is checked against
+    by_trip = np.argsort(trip_codes, kind='stable')
+    codes, times = trip_codes[by_trip], tstamp[by_trip]
+    backwards = (codes[1:] == codes[:-1]) & (times[1:] < times[:-1])
+    unordered_trips = np.zeros(n_trips, dtype=bool)
+    unordered_trips[codes[1:][backwards]] = True
+
+    # Duplicates are adjacent once rows are sorted by trip and then timestamp
+    by_time = np.lexsort((tstamp, trip_codes))
+    codes, times = trip_codes[by_time], tstamp[by_time]
+    repeated = (codes[1:] == codes[:-1]) & (times[1:] == times[:-1])
+    duplicate_rows = np.zeros(n, dtype=bool)
+    duplicate_rows[by_time[1:][repeated]] = True
+
+    def in_trips(flagged):
+        return flagged[trip_codes] & (trip_codes >= 0)
+
+    row_masks = {
+        'negative_speed': negative,
+        'speed_outliers': outliers,
+        'high_speed_trips': in_trips(fast_trips),
+        'non_chronological': in_trips(unordered_trips),
+        'duplicate_timestamps': duplicate_rows,
+        'median_speed': median_violation,
+    }
+    messages = {
+        'negative_speed': "Negative speed records:",
+        'speed_outliers': "Significant outliers in speeds:",
+        'high_speed_trips': f"Trips with average speeds exceeding {max_trip_mean_speed} meters per second:",
+        'non_chronological': "Non-chronological timestamp records:",
+        'duplicate_timestamps': "Duplicate timestamp records:",
+        'median_speed': "More than 50% of breadcrumb records do not have speeds below the median speed:",
+    }
+
+    report = {'rows': n, 'duplicate_rows': duplicate_rows, 'checks': {}}
+    for name, mask in row_masks.items():
+        rows = np.flatnonzero(mask)
+        count = len(rows)
+        report['checks'][name] = {
+            'count': count,
+            'trip_ids': pd.unique(df['trip_id'].to_numpy()[rows]).tolist(),
+            'sample': df.iloc[rows[:sample_rows]],
+        }
+        if count:
+            print(f"{messages[name]} {count} rows in {len(report['checks'][name]['trip_ids'])} trips")
+            if print_frames:
+                print(df[mask])
+    return report
@@ -0,0 +1,190 @@
+import os
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+# Default location of the GTFS feed with shapes.txt and trips.txt
+gtfs_path = 'gtfs'
+
+# GTFS direction_id to the Trip.direction values
+direction_names = {0: 'Out', 1: 'Back'}
+
+# Local flat projection around Portland, good to a few meters across the metro area
+origin_lat, origin_lon = 45.5, -122.7
+meters_per_lat = 110540.0
+meters_per_lon = 111320.0 * np.cos(np.radians(origin_lat))
+
+
+def project(lat, lon):
+    """Latitude/longitude to x/y meters around the Portland origin."""
+    x = (np.asarray(lon, dtype='float64') - origin_lon) * meters_per_lon
+    y = (np.asarray(lat, dtype='float64') - origin_lat) * meters_per_lat
+    return x, y
+
+
+def load_route_shapes(gtfs_dir=gtfs_path):
+    """Read shape points joined to their route and direction from a GTFS feed."""
+    shapes = pd.read_csv(os.path.join(gtfs_dir, 'shapes.txt'),
+                         usecols=['shape_id', 'shape_pt_lat', 'shape_pt_lon', 'shape_pt_sequence'])
+    trips = pd.read_csv(os.path.join(gtfs_dir, 'trips.txt'), usecols=['route_id', 'direction_id', 'shape_id'])
+    routes = trips.drop_duplicates(subset=['shape_id'])
+    return shapes.merge(routes, on='shape_id').sort_values(['shape_id', 'shape_pt_sequence'])
+
+
+class RouteIndex:
+    """KD-tree over route shapes densified to one point every few meters.
+
+    Each indexed point remembers its shape and how far along the shape it
+    lies, which is what lets a match tell the two directions of a route apart.
+    """
+
+    def __init__(self, shapes, spacing=25.0):
+        shape_codes, shape_ids = pd.factorize(shapes['shape_id'])
+        per_shape = shapes.groupby(shape_codes, sort=True)[['route_id', 'direction_id']].first()
+        self.shape_ids = np.asarray(shape_ids)
+        self.shape_route = pd.to_numeric(per_shape['route_id'], errors='coerce').fillna(0).astype('int64').to_numpy()
+        self.shape_direction = per_shape['direction_id'].map(direction_names).fillna('Out').to_numpy()
+
+        x, y = project(shapes['shape_pt_lat'], shapes['shape_pt_lon'])
+        self.x, self.y, self.shape_code, self.along = densify(x, y, shape_codes, spacing)
+        self.tree = cKDTree(np.column_stack([self.x, self.y]))
+
+    @property
+    def n_shapes(self):
+        return len(self.shape_ids)
+
+
+def densify(x, y, codes, spacing):
+    """Interpolate points at most spacing meters apart along every shape."""
+    same = codes[1:] == codes[:-1]
+    seg_len = np.hypot(np.diff(x), np.diff(y))
+    cumulative = np.concatenate([[0.0], np.cumsum(np.where(same, seg_len, 0.0))])
+    starts = np.concatenate([[True], ~same])
+    along = cumulative - cumulative[starts][np.cumsum(starts) - 1]
+
+    segments = np.flatnonzero(same)
+    steps = np.maximum(np.ceil(seg_len[segments] / spacing), 1).astype('int64')
+    seg = np.repeat(segments, steps)
+    offsets = np.repeat(np.cumsum(steps) - steps, steps)
+    frac = (np.arange(len(seg)) - offsets) / np.repeat(steps, steps)
+
+    # Interpolated points cover each segment's start; add each shape's last vertex
+    ends = np.flatnonzero(np.concatenate([~same, [True]]))
+    return (np.concatenate([x[seg] + frac * (x[seg + 1] - x[seg]), x[ends]]),
+            np.concatenate([y[seg] + frac * (y[seg + 1] - y[seg]), y[ends]]),
+            np.concatenate([codes[seg], codes[ends]]),
+            np.concatenate([along[seg] + frac * seg_len[seg], along[ends]]))
+
+
+def load_route_index(gtfs_dir=gtfs_path, spacing=25.0):
+    """Build a RouteIndex from a GTFS feed, or return None if there is none."""
+    if not os.path.exists(os.path.join(gtfs_dir, 'shapes.txt')):
+        return None
+    return RouteIndex(load_route_shapes(gtfs_dir), spacing)
+
+
+def match_trips(df, index, k=16, max_distance=50.0, min_points=10, chunk_size=100000):
+    """Assign each trip in df to its best route and direction.
+
+    Every breadcrumb is matched to the nearest point of each shape within
+    max_distance with a KD-tree query. A (trip, shape) pair then scores one
+    point per match, plus one for every step forward along the shape and
+    minus one for every step backward. Running a route the wrong way scores
+    about zero. Returns trip_id, route_id and direction for the trips that
+    matched at least min_points breadcrumbs; the others are left out.
+
+    Breadcrumbs are queried chunk_size at a time and each chunk is folded
+    into running per-pair totals, so memory stays at k arrays of chunk_size
+    however large df is.
+    """
+    trip_codes, trip_ids = pd.factorize(df['trip_id'])
+    tstamp = df['tstamp'].to_numpy(dtype='datetime64[ns]').view('int64')
+    # Visit breadcrumbs in (trip, time) order; a no-op permutation for sorted frames
+    by_time = np.lexsort((tstamp, trip_codes))
+    lat, lon = df['latitude'].to_numpy()[by_time], df['longitude'].to_numpy()[by_time]
+    trip_codes = trip_codes[by_time]
+
+    # Running totals per (trip, shape) pair, sorted by pair key, with the
+    # along-shape position of the pair's latest point to score the step into the next chunk
+    pairs = np.zeros(0, dtype='int64')
+    hits = np.zeros(0, dtype='int64')
+    forward = np.zeros(0, dtype='int64')
+    backward = np.zeros(0, dtype='int64')
+    last_along = np.zeros(0, dtype='float64')
+    for start in range(0, len(trip_codes), chunk_size):
+        x, y = project(lat[start:start + chunk_size], lon[start:start + chunk_size])
+        key, along = nearest_shapes(index, x, y, trip_codes[start:start + chunk_size], k, max_distance)
+        if not len(key):
+            continue
+
+        starts = np.concatenate([[True], key[1:] != key[:-1]])
+        chunk_pairs, pair = key[starts], np.cumsum(starts) - 1
+        step = np.diff(along)
+        continues = pair[1:] == pair[:-1]
+        chunk_hits = np.bincount(pair, minlength=len(chunk_pairs))
+        chunk_forward = np.bincount(pair[1:][continues & (step > 0)], minlength=len(chunk_pairs))
+        chunk_backward = np.bincount(pair[1:][continues & (step < 0)], minlength=len(chunk_pairs))
+        first_along = along[starts]
+        chunk_last = along[np.concatenate([np.flatnonzero(starts)[1:] - 1, [len(key) - 1]])]
+
+        # Pairs already seen continue from their last point in the earlier chunks
+        pos = np.searchsorted(pairs, chunk_pairs)
+        seen = pos < len(pairs)
+        seen[seen] = pairs[pos[seen]] == chunk_pairs[seen]
+        at = pos[seen]
+        boundary = first_along[seen] - last_along[at]
+        hits[at] += chunk_hits[seen]
+        forward[at] += chunk_forward[seen] + (boundary > 0)
+        backward[at] += chunk_backward[seen] + (boundary < 0)
+        last_along[at] = chunk_last[seen]
+
+        new = ~seen
+        pairs = np.concatenate([pairs, chunk_pairs[new]])
+        order = np.argsort(pairs, kind='stable')
+        pairs = pairs[order]
+        hits = np.concatenate([hits, chunk_hits[new]])[order]
+        forward = np.concatenate([forward, chunk_forward[new]])[order]
+        backward = np.concatenate([backward, chunk_backward[new]])[order]
+        last_along = np.concatenate([last_along, chunk_last[new]])[order]
+    score = hits + forward - backward
+
+    # Best-scoring shape per trip
+    pair_trip, pair_shape = pairs // index.n_shapes, pairs % index.n_shapes
+    best = np.lexsort((-score, pair_trip))
+    best = best[np.concatenate([[True], pair_trip[best][1:] != pair_trip[best][:-1]])]
+    best = best[(hits[best] >= min_points) & (score[best] > 0)]
+
+    return pd.DataFrame({
+        'trip_id': np.asarray(trip_ids)[pair_trip[best]],
+        'route_id': index.shape_route[pair_shape[best]],
+        'direction': index.shape_direction[pair_shape[best]],
+    })
+
+
+def nearest_shapes(index, x, y, trip_codes, k, max_distance):
+    """Match points to the nearest indexed point of each shape within max_distance.
+
+    Returns (pair key, position along the shape) per match, with
+    key = trip code * n_shapes + shape, grouped by key and in point order within a key.
+    """
+    # Neighbours come back nearest first. A stable sort of each row by shape
+    # puts every shape's nearest neighbour at the front of its run.
+    distance, nearest = index.tree.query(np.column_stack([x, y]), k=k,
+                                         distance_upper_bound=max_distance, workers=-1)
+    hit = np.isfinite(distance)
+    shape = np.where(hit, index.shape_code[np.minimum(nearest, len(index.along) - 1)], -1)
+    row_order = np.argsort(shape, axis=1, kind='stable')
+    shape = np.take_along_axis(shape, row_order, axis=1)
+    nearest = np.take_along_axis(nearest, row_order, axis=1)
+    first = np.ones_like(hit)
+    first[:, 1:] = shape[:, 1:] != shape[:, :-1]
+    keep = (first & (shape >= 0)).ravel()
+    point = np.repeat(np.arange(len(x)), k)[keep]
+    shape = shape.ravel()[keep]
+    along = index.along[nearest.ravel()[keep]]
+
+    # Group each (trip, shape) pair; the stable sort keeps points in time order
+    key = trip_codes[point].astype('int64') * index.n_shapes + shape
+    order = np.argsort(key, kind='stable')
+    return key[order], along[order]
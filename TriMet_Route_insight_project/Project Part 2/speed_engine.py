@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+
+def build_timestamps(opd_date, act_time):
+    """Combine OPD_DATE strings and ACT_TIME seconds into datetime64 values."""
+    # Each day of data only carries a handful of distinct OPD_DATE strings,
+    # so parse the unique values once and broadcast them back by code.
+    codes, uniques = pd.factorize(opd_date, sort=False)
+    dates = pd.to_datetime(pd.Index(uniques).str.split(':').str[0], format='%d%b%Y')
+    dates = dates.to_numpy(dtype='datetime64[ns]')
+    day_start = dates[codes]
+    day_start[codes < 0] = np.datetime64('NaT')
+
+    seconds = pd.to_numeric(act_time, errors='coerce').to_numpy(dtype='float64')
+    offset = pd.to_timedelta(np.trunc(seconds), unit='s').to_numpy(dtype='timedelta64[ns]')
+    return day_start + offset
+
+
+def backfill(values):
+    """Backfill NaNs in a 1-D float array with the next valid value."""
+    n = len(values)
+    if n == 0:
+        return values
+    index = np.where(np.isnan(values), n, np.arange(n))
+    next_valid = np.minimum.accumulate(index[::-1])[::-1]
+    filled = values[np.minimum(next_valid, n - 1)]
+    filled[next_valid == n] = np.nan
+    return filled
+
+
+def trip_speeds(trip_ids, meters, seconds):
+    """Speed in m/s for rows already sorted by trip and time."""
+    n = len(trip_ids)
+    speed = np.full(n, np.nan)
+    if n < 2:
+        return speed
+
+    # A row continues the previous row's trip unless the trip id changes.
+    same_trip = trip_ids[1:] == trip_ids[:-1]
+    d_meters = np.diff(meters)
+    d_seconds = np.diff(seconds)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed[1:] = np.where(same_trip, d_meters / d_seconds, np.nan)
+
+    speed = backfill(speed)  # Backfill to handle the first record of each trip
+    return np.maximum(speed, 0)  # No negative speeds, NaN stays NaN
+
+
+def calculate_speed(data):
+    """Add TIMESTAMP and SPEED columns to the breadcrumb frame, sorted by trip."""
+    if 'TIMESTAMP' not in data.columns:  # Frames read back from Parquet already carry it
+        data['TIMESTAMP'] = build_timestamps(data['OPD_DATE'], data['ACT_TIME'])
+    data.sort_values(by=['EVENT_NO_TRIP', 'TIMESTAMP', 'VEHICLE_ID'], inplace=True)
+
+    trip_ids = data['EVENT_NO_TRIP'].to_numpy()
+    meters = pd.to_numeric(data['METERS'], errors='coerce').to_numpy(dtype='float64')
+    seconds = data['TIMESTAMP'].to_numpy(dtype='datetime64[ns]').view('int64') / 1e9
+    data['SPEED'] = trip_speeds(trip_ids, meters, seconds)
+    return data
@@ -0,0 +1,254 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from speed_engine import build_timestamps
+
+
+class TripStateStore:
+    """Last point of every active trip, kept in flat numpy arrays.
+
+    A dict maps each trip id to a slot; the time, odometer reading and last
+    activity of the trip live at that slot in preallocated arrays, which
+    double when full. Evicted slots are reused.
+    """
+
+    def __init__(self, capacity=1024):
+        self.slots = {}
+        self.free = list(range(capacity - 1, -1, -1))
+        self.trip_id = np.zeros(capacity, dtype=np.int64)
+        self.last_time = np.zeros(capacity, dtype=np.int64)
+        self.last_meters = np.zeros(capacity, dtype=np.float64)
+        self.last_seen = np.zeros(capacity, dtype=np.int64)
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.slots)
+
+    def lookup(self, trip_ids):
+        """Slot of each trip id, or -1 for trips with no state."""
+        get = self.slots.get
+        return np.fromiter((get(t, -1) for t in trip_ids.tolist()), dtype=np.int64, count=len(trip_ids))
+
+    def assign(self, trip_ids):
+        """Give each (new, distinct) trip id a slot. Returns the slots."""
+        slots = np.empty(len(trip_ids), dtype=np.int64)
+        for i, trip_id in enumerate(trip_ids.tolist()):
+            if not self.free:
+                self._grow()
+            slot = self.free.pop()
+            self.slots[trip_id] = slot
+            self.trip_id[slot] = trip_id
+            slots[i] = slot
+        return slots
+
+    def _grow(self):
+        size = len(self.trip_id)
+        for name in ('trip_id', 'last_time', 'last_meters', 'last_seen'):
+            array = getattr(self, name)
+            setattr(self, name, np.concatenate([array, np.zeros(max(size, 1), dtype=array.dtype)]))
+        self.free.extend(range(len(self.trip_id) - 1, size - 1, -1))
+
+    def evict(self, before):
+        """Forget trips whose last point is older than before. Returns how many were dropped."""
+        if not self.slots:
+            return 0
+        slots = np.fromiter(self.slots.values(), dtype=np.int64, count=len(self.slots))
+        stale = slots[self.last_seen[slots] < before]
+        for slot in stale.tolist():
+            self.remove(int(self.trip_id[slot]))
+        self.evicted += len(stale)
+        return len(stale)
+
+    def remove(self, trip_id):
+        """Forget one trip and free its slot."""
+        self.free.append(self.slots.pop(trip_id))
+
+
+class StreamingSpeed:
+    """Compute breadcrumb speeds as rows arrive, without re-sorting everything seen.
+
+    Rows wait in a buffer until the watermark, lateness seconds behind the
+    newest timestamp seen, passes them. Only the rows being released are
+    sorted, by trip and time, and each trip's speed chain continues from the
+    last point kept in the TripStateStore. The watermark also moves forward
+    with the wall clock while no newer rows arrive, so a quiet stream still
+    releases what it holds within about lateness seconds.
+
+    Matching calculate_speed, a trip's first point takes the speed of its
+    second, and speeds are clipped at zero. Rows at or behind the point their
+    trip already reached (duplicates, or rows later than the watermark) are
+    released with a NaN speed and counted as stale. Trips with no new point
+    for ttl seconds are evicted.
+
+    Trip state moves forward as rows are released, before the caller has
+    stored them. Call commit() once the released rows are stored; reset()
+    instead undoes every change since the last commit, so rows redelivered
+    after a failed load are not taken for stale.
+    """
+
+    def __init__(self, lateness=30, ttl=900, capacity=1024):
+        self.lateness = int(lateness)
+        self.ttl = int(ttl)
+        self.trips = TripStateStore(capacity)
+        self._buffer = []
+        self._empty = None
+        self._max_time = None
+        self._max_time_wall = None
+        self.released = 0
+        self.stale = 0
+        # Since the last commit: (watermark and counters, {trip_id: previous point or None})
+        self._undo = None
+
+    def buffered(self):
+        return sum(len(frame) for frame in self._buffer)
+
+    def watermark(self):
+        """Seconds since the epoch up to which rows are released."""
+        if self._max_time is None:
+            return None
+        idle = int(time.monotonic() - self._max_time_wall)
+        return self._max_time + idle - self.lateness
+
+    def push(self, df):
+        """Buffer df and return the rows now behind the watermark, with SPEED set.
+
+        df needs EVENT_NO_TRIP, METERS and either TIMESTAMP or OPD_DATE and
+        ACT_TIME. An empty df just lets the watermark release held rows.
+        """
+        self._begin()
+        if self._empty is None:
+            self._empty = df.iloc[:0].assign(TIMESTAMP=pd.Series(dtype='datetime64[ns]'), SPEED=np.zeros(0))
+        if len(df):
+            if 'TIMESTAMP' not in df.columns:
+                df = df.assign(TIMESTAMP=build_timestamps(df['OPD_DATE'], df['ACT_TIME']))
+            newest = int(df['TIMESTAMP'].max().value // 10**9)
+            if self._max_time is None or newest > self._max_time:
+                self._max_time, self._max_time_wall = newest, time.monotonic()
+            self._buffer.append(df)
+        return self._release(self.watermark())
+
+    def flush(self):
+        """Release everything still buffered, lone first points included."""
+        self._begin()
+        return self._release(None)
+
+    def commit(self):
+        """Keep the trip state of everything released so far, once it is stored."""
+        self._undo = None
+
+    def reset(self):
+        """Drop buffered rows and undo the trip state changes since the last commit.
+
+        Used when the released rows were not stored and every held message was
+        nacked, so the redelivered rows continue from where the trips were.
+        """
+        self._buffer = []
+        if self._undo is None:
+            return
+        (self._max_time, self._max_time_wall, self.released, self.stale), touched = self._undo
+        self._undo = None
+        for trip_id, point in touched.items():
+            slot = self.trips.slots.get(trip_id)
+            if point is None:
+                if slot is not None:
+                    self.trips.remove(trip_id)
+                continue
+            if slot is None:  # Evicted since
+                slot = int(self.trips.assign(np.array([trip_id], dtype=np.int64))[0])
+            self.trips.last_time[slot], self.trips.last_meters[slot], self.trips.last_seen[slot] = point
+
+    def _begin(self):
+        if self._undo is None:
+            self._undo = ((self._max_time, self._max_time_wall, self.released, self.stale), {})
+
+    def _release(self, watermark):
+        if not self._buffer:
+            return self._empty
+        pending = self._buffer[0] if len(self._buffer) == 1 else pd.concat(self._buffer, ignore_index=True)
+        seconds = pending['TIMESTAMP'].to_numpy(dtype='datetime64[s]').astype(np.int64)
+        trip_ids = pd.to_numeric(pending['EVENT_NO_TRIP']).to_numpy(dtype=np.int64)
+
+        if watermark is None:
+            ready = np.ones(len(pending), dtype=bool)
+        else:
+            ready = seconds <= watermark
+            # Hold the only ready point of a trip with no state until its second
+            # point is ready too, so it can take that point's speed
+            codes, uniques = pd.factorize(trip_ids)
+            unknown = self.trips.lookup(uniques) < 0
+            lone = (np.bincount(codes[ready], minlength=len(uniques)) == 1) & unknown
+            ready &= ~(lone[codes] & (seconds > watermark - self.ttl))
+
+        self._buffer = [pending[~ready]] if not ready.all() else []
+        if not ready.any():
+            return self._empty
+
+        order = np.flatnonzero(ready)
+        order = order[np.lexsort((seconds[order], trip_ids[order]))]
+        out = pending.iloc[order].copy()
+        out['SPEED'] = self._speeds(trip_ids[order], seconds[order],
+                                    pd.to_numeric(out['METERS'], errors='coerce').to_numpy(dtype=np.float64))
+        self.released += len(out)
+        if watermark is not None:
+            self.trips.evict(watermark - self.ttl)
+        return out
+
+    def _speeds(self, trip, seconds, meters):
+        """Speeds of rows sorted by (trip, time), continuing each trip's stored chain."""
+        n = len(trip)
+        group_start = np.concatenate([[True], trip[1:] != trip[:-1]])
+        starts = np.flatnonzero(group_start)
+        group = np.cumsum(group_start) - 1
+        slots = self.trips.lookup(trip[starts])
+        known = slots >= 0
+
+        # Rows are sorted, so a row is stale if it repeats the time of the row
+        # before it in its trip or is not after the trip's stored point
+        stale = np.zeros(n, dtype=bool)
+        stale[1:] = (seconds[1:] == seconds[:-1]) & ~group_start[1:]
+        floor = np.full(len(starts), np.iinfo(np.int64).min)
+        floor[known] = self.trips.last_time[slots[known]]
+        stale |= seconds <= floor[group]
+        self.stale += int(stale.sum())
+
+        fresh = np.flatnonzero(~stale)
+        f_trip, f_seconds, f_meters = trip[fresh], seconds[fresh], meters[fresh]
+        f_start = np.concatenate([[True], f_trip[1:] != f_trip[:-1]]) if len(fresh) else np.zeros(0, dtype=bool)
+        f_group = group[fresh]
+
+        prev_seconds = np.empty(len(fresh), dtype=np.float64)
+        prev_meters = np.empty(len(fresh), dtype=np.float64)
+        prev_seconds[1:], prev_meters[1:] = f_seconds[:-1], f_meters[:-1]
+        first = np.flatnonzero(f_start)
+        first_known = known[f_group[first]]
+        prev_seconds[first] = np.where(first_known, self.trips.last_time[np.maximum(slots[f_group[first]], 0)], np.nan)
+        prev_meters[first] = np.where(first_known, self.trips.last_meters[np.maximum(slots[f_group[first]], 0)], np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            f_speed = (f_meters - prev_meters) / (f_seconds - prev_seconds)
+        # A new trip's first point takes the speed of its second
+        new_first = first[~first_known]
+        has_next = new_first + 1 < len(fresh)
+        has_next[has_next] &= ~f_start[new_first[has_next] + 1]
+        f_speed[new_first[has_next]] = f_speed[new_first[has_next] + 1]
+
+        speed = np.full(n, np.nan)
+        speed[fresh] = np.maximum(f_speed, 0)
+
+        # Remember where every trip with fresh rows got to
+        if len(fresh):
+            last = np.concatenate([np.flatnonzero(f_start)[1:] - 1, [len(fresh) - 1]])
+            last_group = f_group[last]
+            last_slots = slots[last_group]
+            new = last_slots < 0
+            touched = self._undo[1]
+            for trip_id, slot in zip(f_trip[last].tolist(), last_slots.tolist()):
+                if trip_id not in touched:
+                    touched[trip_id] = None if slot < 0 else (
+                        self.trips.last_time[slot], self.trips.last_meters[slot], self.trips.last_seen[slot])
+            last_slots[new] = self.trips.assign(f_trip[last][new])
+            self.trips.last_time[last_slots] = f_seconds[last]
+            self.trips.last_meters[last_slots] = f_meters[last]
+            self.trips.last_seen[last_slots] = f_seconds[last]
+        return speed
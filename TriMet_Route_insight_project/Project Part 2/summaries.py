@@ -0,0 +1,196 @@
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+
+# Speeds are kept as a histogram of speed_bins bins of speed_bin_width m/s, so
+# a trip split across many batches still gets a p95 without rereading its
+# breadcrumbs. The last bin collects everything at or above 39.5 m/s.
+speed_bin_width = 0.5
+speed_bins = 80
+
+# Per-trip state. Every column merges with a sum, min or max, so a batch's
+# partial aggregate can be folded into the stored row with one upsert. Mean,
+# distance, duration and p95 are derived from it as generated columns.
+trip_state_columns = ('trip_id', 'vehicle_id', 'service_date', 'points', 'speed_points', 'speed_sum', 'max_speed',
+                      'min_meters', 'max_meters', 'start_time', 'end_time',
+                      'min_latitude', 'max_latitude', 'min_longitude', 'max_longitude', 'speed_hist')
+
+summary_schema = f"""
+CREATE OR REPLACE FUNCTION speed_quantile(hist int[], q float8) RETURNS real
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT ((min(i) - 0.5) * {speed_bin_width})::real
+    FROM (SELECT i, sum(c) OVER (ORDER BY i) AS running, sum(c) OVER () AS total
+          FROM unnest(hist) WITH ORDINALITY AS h(c, i)) counts
+    WHERE total > 0 AND running >= q * total
+$$;
+
+CREATE TABLE IF NOT EXISTS trip_summary (
+    trip_id int PRIMARY KEY,
+    vehicle_id int,
+    service_date date,
+    points int,
+    speed_points int,
+    speed_sum float8,
+    max_speed float8,
+    min_meters float8,
+    max_meters float8,
+    start_time timestamp,
+    end_time timestamp,
+    min_latitude float8,
+    max_latitude float8,
+    min_longitude float8,
+    max_longitude float8,
+    speed_hist int[],
+    distance float8 GENERATED ALWAYS AS (max_meters - min_meters) STORED,
+    duration interval GENERATED ALWAYS AS (end_time - start_time) STORED,
+    mean_speed float8 GENERATED ALWAYS AS (speed_sum / NULLIF(speed_points, 0)) STORED,
+    p95_speed real GENERATED ALWAYS AS (speed_quantile(speed_hist, 0.95)) STORED
+);
+CREATE INDEX IF NOT EXISTS trip_summary_vehicle_day ON trip_summary (vehicle_id, service_date);
+
+CREATE TABLE IF NOT EXISTS vehicle_day_summary (
+    vehicle_id int,
+    service_date date,
+    trips int,
+    points int,
+    speed_points int,
+    speed_sum float8,
+    max_speed float8,
+    distance float8,
+    duration interval,
+    start_time timestamp,
+    end_time timestamp,
+    min_latitude float8,
+    max_latitude float8,
+    min_longitude float8,
+    max_longitude float8,
+    speed_hist int[],
+    mean_speed float8 GENERATED ALWAYS AS (speed_sum / NULLIF(speed_points, 0)) STORED,
+    p95_speed real GENERATED ALWAYS AS (speed_quantile(speed_hist, 0.95)) STORED,
+    PRIMARY KEY (vehicle_id, service_date)
+);
+"""
+
+
+def create_summary_tables(conn):
+    """Create the summary tables and their p95 function if needed, and commit."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(summary_schema)
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def trip_state(df):
+    """Aggregate a batch of breadcrumbs into one trip_summary row per trip.
+
+    Expects the loader's column names (trip_id, vehicle_id, tstamp, speed, ...)
+    plus METERS and either service_date or OPD_DATE.
+    """
+    codes, trip_ids = pd.factorize(df['trip_id'])
+    n = len(trip_ids)
+    speed = pd.to_numeric(df['speed'], errors='coerce').to_numpy(dtype='float64')
+    meters = pd.to_numeric(df['METERS'], errors='coerce').to_numpy(dtype='float64')
+    has_speed = ~np.isnan(speed)
+
+    state = pd.DataFrame({
+        'tstamp': df['tstamp'].to_numpy(),
+        'latitude': pd.to_numeric(df['latitude']).to_numpy(dtype='float64'),
+        'longitude': pd.to_numeric(df['longitude']).to_numpy(dtype='float64'),
+        'meters': meters,
+        'speed': speed,
+    }).groupby(codes, sort=True).agg(
+        start_time=('tstamp', 'min'), end_time=('tstamp', 'max'),
+        min_latitude=('latitude', 'min'), max_latitude=('latitude', 'max'),
+        min_longitude=('longitude', 'min'), max_longitude=('longitude', 'max'),
+        min_meters=('meters', 'min'), max_meters=('meters', 'max'),
+        max_speed=('speed', 'max'),
+    )
+    state['points'] = np.bincount(codes, minlength=n)
+    state['speed_points'] = np.bincount(codes[has_speed], minlength=n)
+    state['speed_sum'] = np.bincount(codes[has_speed], weights=speed[has_speed], minlength=n)
+
+    bins = np.minimum((speed[has_speed] / speed_bin_width).astype('int64'), speed_bins - 1)
+    hist = np.bincount(codes[has_speed] * speed_bins + bins, minlength=n * speed_bins).reshape(n, speed_bins)
+    state['speed_hist'] = ['{' + ','.join(map(str, row)) + '}' for row in hist.tolist()]
+
+    first = np.unique(codes, return_index=True)[1]
+    state['trip_id'] = np.asarray(trip_ids)
+    state['vehicle_id'] = df['vehicle_id'].to_numpy()[first]
+    if 'service_date' in df.columns:
+        state['service_date'] = df['service_date'].to_numpy()[first]
+    else:
+        opd_date = pd.Series(df['OPD_DATE'].to_numpy()[first])
+        state['service_date'] = pd.to_datetime(opd_date.str.split(':').str[0], format='%d%b%Y').dt.strftime('%Y-%m-%d').to_numpy()
+    return state[list(trip_state_columns)]
+
+
+def upsert_summaries(conn, df):
+    """Fold a batch into trip_summary and refresh its vehicle-days. Does not commit.
+
+    The batch's trip rows are COPYed into a temp table and merged into
+    trip_summary with one INSERT ... ON CONFLICT. The vehicle-days those trips
+    belong to are then re-rolled from trip_summary, which holds a few hundred
+    rows per vehicle-day, so no breadcrumbs are rescanned.
+    """
+    state = trip_state(df)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS trip_summary_stage
+            (LIKE trip_summary) ON COMMIT DELETE ROWS;
+        """)
+        # Trips with no valid speed or odometer reading have NaN aggregates, sent as NULL
+        buffer = StringIO()
+        state.to_csv(buffer, header=False, index=False, sep='\t', na_rep='\\N')
+        buffer.seek(0)
+        cursor.copy_from(buffer, 'trip_summary_stage', sep='\t', columns=trip_state_columns)
+        cursor.execute("""
+            INSERT INTO trip_summary AS t (trip_id, vehicle_id, service_date, points, speed_points, speed_sum,
+                max_speed, min_meters, max_meters, start_time, end_time,
+                min_latitude, max_latitude, min_longitude, max_longitude, speed_hist)
+            SELECT trip_id, vehicle_id, service_date, points, speed_points, speed_sum,
+                max_speed, min_meters, max_meters, start_time, end_time,
+                min_latitude, max_latitude, min_longitude, max_longitude, speed_hist
+            FROM trip_summary_stage
+            ON CONFLICT (trip_id) DO UPDATE SET
+                points = t.points + EXCLUDED.points,
+                speed_points = t.speed_points + EXCLUDED.speed_points,
+                speed_sum = t.speed_sum + EXCLUDED.speed_sum,
+                max_speed = GREATEST(t.max_speed, EXCLUDED.max_speed),
+                min_meters = LEAST(t.min_meters, EXCLUDED.min_meters),
+                max_meters = GREATEST(t.max_meters, EXCLUDED.max_meters),
+                start_time = LEAST(t.start_time, EXCLUDED.start_time),
+                end_time = GREATEST(t.end_time, EXCLUDED.end_time),
+                min_latitude = LEAST(t.min_latitude, EXCLUDED.min_latitude),
+                max_latitude = GREATEST(t.max_latitude, EXCLUDED.max_latitude),
+                min_longitude = LEAST(t.min_longitude, EXCLUDED.min_longitude),
+                max_longitude = GREATEST(t.max_longitude, EXCLUDED.max_longitude),
+                speed_hist = ARRAY(SELECT a + b FROM unnest(t.speed_hist, EXCLUDED.speed_hist)
+                                   WITH ORDINALITY AS h(a, b, i) ORDER BY i);
+
+            INSERT INTO vehicle_day_summary (vehicle_id, service_date, trips, points, speed_points, speed_sum,
+                max_speed, distance, duration, start_time, end_time,
+                min_latitude, max_latitude, min_longitude, max_longitude, speed_hist)
+            SELECT t.vehicle_id, t.service_date, count(*), sum(t.points), sum(t.speed_points), sum(t.speed_sum),
+                   max(t.max_speed), sum(t.distance), sum(t.duration), min(t.start_time), max(t.end_time),
+                   min(t.min_latitude), max(t.max_latitude), min(t.min_longitude), max(t.max_longitude),
+                   ARRAY(SELECT sum(h.c)::int
+                         FROM trip_summary d, unnest(d.speed_hist) WITH ORDINALITY AS h(c, i)
+                         WHERE d.vehicle_id = t.vehicle_id AND d.service_date = t.service_date
+                         GROUP BY h.i ORDER BY h.i)
+            FROM trip_summary t
+            WHERE (t.vehicle_id, t.service_date) IN (SELECT DISTINCT vehicle_id, service_date FROM trip_summary_stage)
+            GROUP BY t.vehicle_id, t.service_date
+            ON CONFLICT (vehicle_id, service_date) DO UPDATE SET
+                trips = EXCLUDED.trips, points = EXCLUDED.points, speed_points = EXCLUDED.speed_points,
+                speed_sum = EXCLUDED.speed_sum, max_speed = EXCLUDED.max_speed, distance = EXCLUDED.distance,
+                duration = EXCLUDED.duration, start_time = EXCLUDED.start_time, end_time = EXCLUDED.end_time,
+                min_latitude = EXCLUDED.min_latitude, max_latitude = EXCLUDED.max_latitude,
+                min_longitude = EXCLUDED.min_longitude, max_longitude = EXCLUDED.max_longitude,
+                speed_hist = EXCLUDED.speed_hist;
+        """)
+    finally:
+        cursor.close()
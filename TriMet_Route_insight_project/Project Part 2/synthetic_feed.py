@@ -0,0 +1,108 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from route_match import meters_per_lat, meters_per_lon
+
+# Trips start somewhere inside this box around Portland
+lat_range = (45.40, 45.60)
+lon_range = (-122.85, -122.50)
+
+
+def iter_breadcrumbs(rows, vehicles=500, points_per_trip=200, ping_seconds=5, noise_meters=8.0,
+                     duplicate_rate=0.01, disorder_rate=0.05, invalid_rate=0.001,
+                     opd_date='12MAY2024:00:00:00', chunk_rows=250_000, seed=11):
+    """Yield DataFrames of synthetic breadcrumbs, shaped like the API's JSON records.
+
+    Each trip belongs to one vehicle and drives away from a random start at a
+    varying speed, pinging every ping_seconds with GPS noise. Within a chunk
+    about duplicate_rate of the records are sent twice, disorder_rate of them
+    arrive a few positions late, and invalid_rate fail validation (out of
+    bounds latitude or negative meters). Chunks hold whole trips, so memory
+    stays bounded by chunk_rows whatever the total.
+    """
+    rng = np.random.default_rng(seed)
+    total_trips = -(-rows // points_per_trip)
+    trips_per_chunk = max(1, chunk_rows // points_per_trip)
+    emitted = 0
+    for first_trip in range(0, total_trips, trips_per_chunk):
+        trips = min(trips_per_chunk, total_trips - first_trip)
+        n = min(trips * points_per_trip, rows - emitted)
+        trip = np.repeat(np.arange(trips), points_per_trip)[:n]
+        step = np.tile(np.arange(points_per_trip), trips)[:n]
+
+        # A speed is drawn for every ping; METERS is the distance since the trip's first ping
+        speed = np.clip(rng.normal(8.0, 4.0, n), 0, 25)
+        travelled = np.cumsum(speed * ping_seconds)
+        meters = travelled - np.repeat(travelled[step == 0], points_per_trip)[:n]
+
+        start_time = rng.integers(4 * 3600, 22 * 3600, trips)
+        heading = rng.uniform(0, 2 * np.pi, trips)
+        start_lat = rng.uniform(*lat_range, trips)
+        start_lon = rng.uniform(*lon_range, trips)
+        x = meters * np.cos(heading[trip]) + rng.normal(0, noise_meters, n)
+        y = meters * np.sin(heading[trip]) + rng.normal(0, noise_meters, n)
+
+        chunk = pd.DataFrame({
+            'EVENT_NO_TRIP': 220000000 + first_trip + trip,
+            'ACT_TIME': start_time[trip] + step * ping_seconds,
+            'OPD_DATE': opd_date,
+            'VEHICLE_ID': 3000 + (first_trip + trip) % vehicles,
+            'METERS': meters.round().astype('int64'),
+            'GPS_LATITUDE': start_lat[trip] + y / meters_per_lat,
+            'GPS_LONGITUDE': start_lon[trip] + x / meters_per_lon,
+            'GPS_SATELLITES': rng.integers(6, 13, n),
+            'GPS_HDOP': rng.uniform(0.6, 2.0, n).round(1),
+        })
+
+        invalid = np.flatnonzero(rng.random(n) < invalid_rate)
+        half = len(invalid) // 2
+        chunk.loc[invalid[:half], 'GPS_LATITUDE'] = 47.5
+        chunk.loc[invalid[half:], 'METERS'] = -1
+
+        # Late records swap places with one a few positions further on
+        order = np.arange(n)
+        late = np.flatnonzero(rng.random(n) < disorder_rate)
+        target = np.minimum(late + rng.integers(1, 20, len(late)), n - 1)
+        order[late], order[target] = order[target], order[late]
+        duplicates = np.flatnonzero(rng.random(n) < duplicate_rate)
+        order = np.insert(order, duplicates, order[duplicates])
+
+        emitted += n
+        yield chunk.iloc[order].reset_index(drop=True)
+
+
+def write_feed(path, rows, **options):
+    """Write rows synthetic breadcrumbs to path as JSON lines. Returns the record count."""
+    written = 0
+    with open(path, 'w') as file:
+        for chunk in iter_breadcrumbs(rows, **options):
+            chunk.to_json(file, orient='records', lines=True)
+            written += len(chunk)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic TriMet breadcrumb dump as JSON lines.")
+    parser.add_argument('path')
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--vehicles', type=int, default=500)
+    parser.add_argument('--points-per-trip', type=int, default=200)
+    parser.add_argument('--ping-seconds', type=int, default=5)
+    parser.add_argument('--noise-meters', type=float, default=8.0)
+    parser.add_argument('--duplicate-rate', type=float, default=0.01)
+    parser.add_argument('--disorder-rate', type=float, default=0.05)
+    parser.add_argument('--invalid-rate', type=float, default=0.001)
+    parser.add_argument('--seed', type=int, default=11)
+    args = parser.parse_args()
+
+    written = write_feed(args.path, args.rows, vehicles=args.vehicles, points_per_trip=args.points_per_trip,
+                         ping_seconds=args.ping_seconds, noise_meters=args.noise_meters,
+                         duplicate_rate=args.duplicate_rate, disorder_rate=args.disorder_rate,
+                         invalid_rate=args.invalid_rate, seed=args.seed)
+    print(f"Wrote {written} records to {args.path}")
+
+
+if __name__ == "__main__":
+    main()